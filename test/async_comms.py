@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: drives many shell simulators at once from one process, with asyncio.
+Date: 18.10.26
+
+Every shell runs on its own terminal (pty), and its output is read by the
+event loop (loop.add_reader), so waiting shells cost no threads or worker
+processes. Each shell gets its own working directory, and so its own disk
+image. Commands have the deadlines of deadlines.py, a shell missing one is
+killed and ShellHung is raised.
+
+Run: "python3 async_comms.py --sessions 200" to run a mixed workload in
+200 shells at once, and print the throughput.
+'''
+
+import os
+import pty
+import sys
+import time
+import shutil
+import signal
+import asyncio
+import termios
+import argparse
+import tempfile
+import re as regex
+import config as cfg
+from sim_comms import chunk_lines, split_words, validate_output, CHUNK_SIZE
+from deadlines import DEADLINES, ShellHung, process_state
+
+class AsyncShell:
+    '''
+    One shell simulator driven by asyncio. Use in an "async with" statement,
+    or call open() and close(). Commands are run one at a time per shell.
+    '''
+
+    def __init__(self, workDir: str, timeout: int = cfg.TIMEOUT):
+        self.workDir = workDir
+        self.timeout = timeout
+        self.process = None
+        self.fd = None
+
+        # Output not yet returned, and a future set when more arrives.
+        self.buffer = ""
+        self.changed = None
+        self.closed = False
+
+        # Shell output before the first prompt.
+        self.banner = ""
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        if excType is None:
+            await self.close()
+        else:
+            self.kill()
+
+    async def open(self):
+        ''' Starts the shell simulator, and waits for the first prompt. '''
+
+        # The shell gets a terminal, so its output is not buffered, with echo off.
+        self.fd, slave = pty.openpty()
+        attributes = termios.tcgetattr(slave)
+        attributes[3] &= ~termios.ECHO
+        termios.tcsetattr(slave, termios.TCSANOW, attributes)
+
+        try:
+            self.process = await asyncio.create_subprocess_exec(cfg.BINARY, cwd=self.workDir, stdin=slave,
+                                                                stdout=slave, stderr=slave, start_new_session=True)
+        finally:
+            os.close(slave)
+
+        os.set_blocking(self.fd, False)
+        asyncio.get_running_loop().add_reader(self.fd, self.read)
+
+        start = time.monotonic()
+        self.banner = await self.expect("<start>")
+        DEADLINES.observe("<start>", time.monotonic() - start)
+
+    def read(self):
+        ''' Called by the event loop when output is ready. '''
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            # The terminal is closed when the shell exits.
+            data = b""
+
+        if data:
+            self.buffer += data.decode("utf-8", errors="replace")
+        else:
+            self.closed = True
+            asyncio.get_running_loop().remove_reader(self.fd)
+
+        if self.changed is not None and not self.changed.done():
+            self.changed.set_result(None)
+
+    async def wait_output(self, deadline: float):
+        ''' Waits until more output arrives, or the deadline (time.monotonic) is passed. '''
+
+        self.changed = asyncio.get_running_loop().create_future()
+        await asyncio.wait_for(self.changed, max(0.0, deadline - time.monotonic()))
+
+    async def prompt(self, deadline: float):
+        ''' Waits for the next prompt, and returns the output in front of it, or None if the deadline is passed. '''
+
+        while True:
+            match = regex.search(cfg.PROMPT, self.buffer)
+            if match is not None:
+                output = self.buffer[:match.start()]
+                self.buffer = self.buffer[match.end():]
+                return output
+
+            if self.closed:
+                return None
+
+            try:
+                await self.wait_output(deadline)
+            except asyncio.TimeoutError:
+                return None
+
+    async def expect(self, command: str, budget: float = None):
+        '''
+        Waits for the prompt after a command, and returns the output in front
+        of it. The shell is killed if it misses the deadline of the command
+        (or budget seconds, if given), or if it is stalled, i.e. sleeping
+        with no output or CPU time used for STALL_TIME seconds.
+        '''
+
+        if budget is None:
+            budget = min(self.timeout, DEADLINES.budget(command))
+        deadline = time.monotonic() + budget
+        lastState = None
+
+        while True:
+            # Check the process when no output has come for a while.
+            output = await self.prompt(min(deadline, time.monotonic() + cfg.STALL_TIME))
+            if output is not None:
+                return output
+
+            state = process_state(self.process.pid)
+            if self.closed:
+                reason = "exited without a prompt"
+            elif time.monotonic() >= deadline:
+                reason = "not done within its deadline of {:.2f} s".format(budget)
+            elif state == lastState and state[0] in ("S", "T", "t") and command != "<start>":
+                reason = "waiting for input with no prompt for {:.2f} s".format(cfg.STALL_TIME)
+            else:
+                lastState = state
+                continue
+
+            self.kill()
+            raise ShellHung(command, reason)
+
+    async def send(self, data: bytes):
+        ''' Sends input, waiting while the terminal is full. '''
+
+        loop = asyncio.get_running_loop()
+
+        while data:
+            try:
+                data = data[os.write(self.fd, data):]
+            except BlockingIOError:
+                # Wait until the shell has read some input.
+                writable = loop.create_future()
+                loop.add_writer(self.fd, lambda: writable.done() or writable.set_result(None))
+                try:
+                    await asyncio.wait_for(writable, self.timeout)
+                except asyncio.TimeoutError:
+                    self.kill()
+                    raise ShellHung("<input>", "not reading input for {} s".format(self.timeout))
+                finally:
+                    loop.remove_writer(self.fd)
+
+    async def run(self, command: str):
+        ''' Runs one command, and returns its output as text. '''
+
+        start = time.monotonic()
+        await self.send((command + "\n").encode())
+        output = await self.expect(command)
+        DEADLINES.observe(command, time.monotonic() - start)
+
+        return output
+
+    async def write(self, filename: str, strLines, chunkSize: int = CHUNK_SIZE):
+        ''' Stores lines in a file with cat, and returns the output as text. Lines may be any iterable. '''
+
+        command = "cat " + filename
+        await self.send((command + "\n").encode())
+
+        failed = False
+        for chunk in chunk_lines(strLines, chunkSize):
+            # Let the reader take the output so far, and stop sending if cat has failed, i.e. a prompt is shown.
+            await asyncio.sleep(0)
+            if regex.search(cfg.PROMPT, self.buffer) is not None:
+                failed = True
+                break
+            await self.send(chunk)
+
+        output = ""
+        if not failed:
+            # Streamed writes move any number of bytes, so they get the timeout, not a learned deadline.
+            await self.send(b".\n")
+            output = await self.expect(command, self.timeout)
+
+        # If cat failed, the lines sent were run as commands, read their prompts until quiet.
+        if failed or validate_output(split_words(output), []) != 0:
+            more = await self.prompt(time.monotonic() + cfg.STALL_TIME)
+            while more is not None:
+                output += more
+                more = await self.prompt(time.monotonic() + cfg.STALL_TIME)
+
+        return output
+
+    async def close(self):
+        ''' Exits the shell, and returns the output not yet read as text. '''
+
+        if self.process is None:
+            return ""
+
+        await self.send(b"exit\n")
+        deadline = time.monotonic() + min(self.timeout, DEADLINES.budget("exit"))
+
+        # Read until the shell has exited and closed the terminal.
+        while not self.closed:
+            try:
+                await self.wait_output(deadline)
+            except asyncio.TimeoutError:
+                self.kill()
+                raise ShellHung("exit", "did not exit")
+
+        await self.process.wait()
+        output = self.buffer
+        self.release()
+
+        return output
+
+    def kill(self):
+        ''' Kills the shell at once. '''
+
+        if self.process is None:
+            return
+
+        if self.process.returncode is None:
+            self.process.send_signal(signal.SIGKILL)
+        self.release()
+
+    def release(self):
+        ''' Closes the terminal. '''
+
+        if not self.closed:
+            asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+        self.process = None
+
+async def run_sessions(workload, count: int, concurrency: int = 100, image: str = None):
+    '''
+    Runs "await workload(shell, num)" in count shells, at most concurrency
+    at a time, each in a new working directory. If image is given, every
+    shell starts on a copy of that disk image, else on a new file system.
+    Returns the results in order, or the exception raised by a workload.
+    '''
+
+    cfg.compile()
+    limit = asyncio.Semaphore(concurrency)
+    basePath = tempfile.mkdtemp(prefix="p6-async-")
+
+    async def session(num: int):
+        async with limit:
+            workDir = tempfile.mkdtemp(prefix="shell-", dir=basePath)
+            if image is not None:
+                shutil.copyfile(image, workDir + "/" + cfg.DISK_NAME)
+
+            try:
+                async with AsyncShell(workDir) as shell:
+                    return await workload(shell, num)
+            finally:
+                shutil.rmtree(workDir, ignore_errors=True)
+
+    try:
+        return await asyncio.gather(*(session(num) for num in range(count)), return_exceptions=True)
+    finally:
+        shutil.rmtree(basePath, ignore_errors=True)
+
+async def mixed_workload(shell: AsyncShell, num: int, commands: int = 50):
+    ''' Creates, lists, reads and removes files and directories. Returns the commands run and the errors. '''
+
+    errors = 0
+    run = 0
+
+    for step in range(commands // 5):
+        name = "s{}_{}".format(num, step)
+        outputs = [await shell.run("mkdir d" + name), await shell.write("f" + name, ["line {}".format(step)] * 20),
+                   await shell.run("ls"), await shell.run("more f" + name), await shell.run("rm f" + name)]
+        errors += sum(1 for output in outputs if validate_output(split_words(output), []) != 0)
+        run += len(outputs)
+
+    return run, errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a mixed workload in many shells at once.")
+    parser.add_argument("--sessions", type=int, default=100, help="shells to run")
+    parser.add_argument("--concurrency", type=int, default=100, help="most shells running at once")
+    parser.add_argument("--commands", type=int, default=50, help="commands per shell")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = asyncio.run(run_sessions(lambda shell, num: mixed_workload(shell, num, args.commands),
+                                       args.sessions, args.concurrency))
+    seconds = time.perf_counter() - start
+    cfg.cleanup()
+    DEADLINES.save()
+
+    failed = [result for result in results if isinstance(result, BaseException)]
+    commands = sum(result[0] for result in results if not isinstance(result, BaseException))
+    errors = sum(result[1] for result in results if not isinstance(result, BaseException))
+
+    print("{} shells, {} commands in {:.2f} s, {:.0f} commands/s, {} error codes, {} shells failed.".format(
+          args.sessions, commands, seconds, commands / seconds, errors, len(failed)))
+    for error in failed[:5]:
+        print("  {!r}".format(error))
+
+    sys.exit(1 if failed or errors else 0)
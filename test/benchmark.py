@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+
+'''
+Benchmark of the file system, via the shell program.
+
+Written by: Isak Kjerstad.
+Purpose: measures the speed of file system operations, and reports it as JSON.
+Date: 18.10.26
+
+Run: "python3 benchmark.py" to run all workloads and print the results.
+Run: "python3 benchmark.py --workload files_in_dir --size 100 --output bench.json"
+to run one workload with a given size, and store the results.
+'''
+
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess as process
+from collections import defaultdict
+import config as cfg
+from timing import summarize
+from sim_comms import ShellSession, split_words, validate_output
+from deadlines import DEADLINES
+
+# Times the repeated part of every workload runs, more than any warm-up allowed.
+ROUNDS = 20
+
+class Recorder:
+    ''' Runs commands in a shell session, and records the latency of each command type. '''
+
+    def __init__(self, shell: ShellSession):
+        self.shell = shell
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+        # Bytes written with cat, and the seconds used.
+        self.written = [0, 0.0]
+
+    def record(self, operation: str, output: str, start: float):
+        ''' Stores the latency and any error of one command. '''
+
+        self.latencies[operation].append(time.perf_counter() - start)
+        if validate_output(split_words(output), []) != 0:
+            self.errors[operation] += 1
+
+    def run(self, command: str):
+        ''' Runs one command. '''
+
+        start = time.perf_counter()
+        output = self.shell.run(command)
+        self.record(command.split()[0], output, start)
+
+        return output
+
+    def write(self, filename: str, strLines: list):
+        ''' Writes lines to a file with cat. '''
+
+        start = time.perf_counter()
+        output, byteCount, seconds = self.shell.write_stream(filename, strLines)
+        self.record("cat", output, start)
+        self.written[0] += byteCount
+        self.written[1] += seconds
+
+        return output
+
+def files_in_dir(recorder: Recorder, size: int):
+    ''' Creates, lists, reads and removes size files in one directory. '''
+
+    recorder.run("mkdir bench")
+    recorder.run("cd bench")
+
+    for num in range(size):
+        recorder.write("f{}".format(num), ["file number {}".format(num)])
+    for _ in range(ROUNDS):
+        recorder.run("ls")
+    for num in range(size):
+        recorder.run("stat f{}".format(num))
+    for num in range(size):
+        recorder.run("more f{}".format(num))
+    for num in range(size):
+        recorder.run("rm f{}".format(num))
+
+def deep_paths(recorder: Recorder, size: int):
+    ''' Builds a directory tree size levels deep, and walks it with absolute paths. '''
+
+    path = ""
+
+    for num in range(size):
+        recorder.run("mkdir d{}".format(num))
+        recorder.run("cd d{}".format(num))
+        path += "/d{}".format(num)
+
+    for _ in range(ROUNDS):
+        recorder.run("cd /")
+        recorder.run("cd " + path)
+        recorder.run("pwd")
+
+def multi_block(recorder: Recorder, size: int):
+    ''' Writes and reads a file of size lines (about 33 bytes each) several times. '''
+
+    strLines = ["Hello World! Check out myWord_{:06d}".format(num) for num in range(size)]
+
+    for _ in range(ROUNDS):
+        recorder.write("bigFile", strLines)
+        recorder.run("stat bigFile")
+        recorder.run("more bigFile")
+
+def large_file(recorder: Recorder, size: int):
+    ''' Writes and reads a file of size KiB several times, it needs indirect blocks. '''
+
+    # Lines of 32 bytes, made when sent.
+    for _ in range(ROUNDS):
+        recorder.write("largeFile", ("{:031d}".format(num) for num in range(size * 32)))
+        recorder.run("stat largeFile")
+        recorder.run("more largeFile")
+
+def link_churn(recorder: Recorder, size: int):
+    ''' Adds and removes size hard links to one file, several times. '''
+
+    recorder.write("target", ["target"])
+
+    for _ in range(ROUNDS):
+        for num in range(size):
+            recorder.run("ln l{} target".format(num))
+        recorder.run("stat target")
+        for num in range(size):
+            recorder.run("rm l{}".format(num))
+
+# Workloads, and their default size.
+WORKLOADS = {
+    "files_in_dir": (files_in_dir, 40),
+    "deep_paths": (deep_paths, 30),
+    "multi_block": (multi_block, 100),
+    "link_churn": (link_churn, 40),
+    "large_file": (large_file, 64),
+}
+
+def source_revision():
+    ''' Returns the git commit of the source tree, or None. '''
+
+    result = process.run("git rev-parse HEAD", shell=True, cwd=cfg.PATH, stdout=process.PIPE,
+                         stderr=process.DEVNULL, universal_newlines=True)
+
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def run_benchmark(names: list, size: int = None, repeat: int = 1, warmup: int = 5):
+    '''
+    Runs the named workloads, each on a new disk image and repeat times,
+    and returns the results as a dictionary. The first warmup commands of
+    each type are left out of every run, but commands run once (setup) are
+    kept. Raises ValueError if warmup is not less than ROUNDS.
+    '''
+
+    if not 0 <= warmup < ROUNDS:
+        raise ValueError("warm-up must be from 0 to {}, the workloads repeat {} times".format(ROUNDS - 1, ROUNDS))
+
+    cfg.compile()
+
+    results = {
+        "build_hash": cfg.BUILD_HASH,
+        "source_revision": source_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "settings": {"repeat": repeat, "warmup": warmup},
+        "workloads": {},
+    }
+
+    for name in names:
+        workload, defaultSize = WORKLOADS[name]
+        workSize = size if size is not None else defaultSize
+        latencies = defaultdict(list)
+        dropped = defaultdict(int)
+        errors = defaultdict(int)
+        written = [0, 0.0]
+        start = time.perf_counter()
+
+        for _ in range(repeat):
+            # Every run starts on a new file system.
+            cfg.reset_disk()
+            with ShellSession() as shell:
+                recorder = Recorder(shell)
+                workload(recorder, workSize)
+
+            # Leave out the warm-up of this run, at least one value is kept.
+            for operation, values in recorder.latencies.items():
+                drop = max(0, min(warmup, len(values) - 1))
+                latencies[operation] += values[drop:]
+                dropped[operation] += drop
+            for operation, count in recorder.errors.items():
+                errors[operation] += count
+            written[0] += recorder.written[0]
+            written[1] += recorder.written[1]
+
+        results["workloads"][name] = {
+            "size": workSize,
+            "seconds": time.perf_counter() - start,
+            "operations": {operation: dict(summarize(values), warmup=dropped[operation], errors=errors[operation])
+                           for operation, values in latencies.items()},
+            "write_bytes_per_second": written[0] / written[1] if written[1] > 0 else None,
+        }
+
+    cfg.cleanup()
+    DEADLINES.save()
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="File system benchmark.")
+    parser.add_argument("--workload", action="append", choices=sorted(WORKLOADS),
+                        help="workload to run, may be given several times (default: all)")
+    parser.add_argument("--size", type=int, help="workload size (default: per workload)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each workload")
+    parser.add_argument("--warmup", type=int, default=5, help="first commands of each type left out of statistics")
+    parser.add_argument("--output", help="JSON file to write (default: standard output)")
+    args = parser.parse_args()
+    if not 0 <= args.warmup < ROUNDS:
+        parser.error("--warmup must be from 0 to {}".format(ROUNDS - 1))
+
+    results = run_benchmark(args.workload or list(WORKLOADS), args.size, args.repeat, args.warmup)
+
+    if args.output:
+        with open(args.output, "w") as outFile:
+            json.dump(results, outFile, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: optional count of the disk blocks changed by every shell command, per region of the disk image.
+Date: 18.10.26
+
+When on, every block of the disk image is hashed after the first prompt of
+a shell and after every command, through a memory map (see disk_image.py).
+The blocks with a new hash are given to the command, by region: superblock,
+inode bitmap, data bitmap, inode table and data. A block written again with
+the same content is not seen. Turn it on with WRITES.enable(), or
+"python3 main.py --writes".
+
+Run: "python3 block_writes.py 'mkdir a' 'cat f'" to print the blocks changed
+by each command, on a new file system. Both need DISK_LAYOUT in config.py.
+'''
+
+import os
+import sys
+import hashlib
+import argparse
+from collections import defaultdict
+import config as cfg
+from disk_image import DiskImage, disk_layout
+
+REGION_NAMES = ("superblock", "inode_bitmap", "data_bitmap", "inode_table", "data", "other")
+
+def block_regions(layout: dict):
+    ''' Returns a function giving the region name of an (absolute) block number. '''
+
+    inodeBlocks = -(-layout["inode_count"] * layout["inode_size"] // layout["block_size"])
+    regions = {layout["superblock"]: "superblock", layout["inode_bitmap"]: "inode_bitmap",
+               layout["data_bitmap"]: "data_bitmap"}
+    regions.update((layout["inode_table"] + num, "inode_table") for num in range(inodeBlocks))
+    regions.update((layout["data_start"] + num, "data") for num in range(layout["data_count"]))
+
+    return lambda num: regions.get(num, "other")
+
+def block_hashes(path: str, layout: dict = None):
+    ''' Returns a hash of every block of a disk image, or an empty list if there is no image. '''
+
+    try:
+        if os.path.getsize(path) == 0:
+            return []
+        image = DiskImage(path, layout)
+    except OSError:
+        return []
+
+    with image:
+        return [hashlib.blake2b(image.block(num), digest_size=16).digest()
+                for num in range(len(image.map) // image.blockSize)]
+
+def changed_blocks(before: list, after: list):
+    ''' Returns the numbers of blocks with different hashes, blocks added or removed included. '''
+    return [num for num in range(max(len(before), len(after)))
+            if num >= len(before) or num >= len(after) or before[num] != after[num]]
+
+class BlockTracker:
+    ''' Disk image of one shell, hashed after every command. '''
+
+    def __init__(self, log, path: str):
+        self.log = log
+        self.path = path
+
+        # Block hashes after the last command, none before the first prompt.
+        self.last = []
+
+    def done(self, command: str):
+        ''' Gives the blocks changed since the last command to a command which is done. '''
+
+        hashes = block_hashes(self.path, self.log.layout)
+        self.log.record(command, changed_blocks(self.last, hashes))
+        self.last = hashes
+
+class WriteLog:
+    ''' Blocks changed by shell commands, per command type and region. '''
+
+    def __init__(self, layout: dict = None):
+        self.enabled = False
+        self.layout = layout
+        self.region = None
+        self.clear()
+
+    def clear(self):
+        ''' Removes all recorded blocks. '''
+
+        # Command type -> [count, max. blocks of one command, {region: blocks}].
+        self.totals = defaultdict(lambda: [0, 0, dict.fromkeys(REGION_NAMES, 0)])
+
+    def enable(self):
+        ''' Starts recording. Raises ValueError if DISK_LAYOUT is not set. '''
+
+        self.layout = disk_layout(self.layout)
+        self.region = block_regions(self.layout)
+        self.enabled = True
+
+    def track(self, path: str):
+        ''' Returns a BlockTracker for the disk image of a new shell, or None when recording is off. '''
+        return BlockTracker(self, path) if self.enabled else None
+
+    def record(self, command: str, blocks: list):
+        ''' Stores the blocks changed by one command. '''
+
+        words = command.split()
+        total = self.totals[words[0] if words else ""]
+        total[0] += 1
+        total[1] = max(total[1], len(blocks))
+
+        for num in blocks:
+            total[2][self.region(num)] += 1
+
+    def state(self):
+        ''' Returns the recorded blocks as plain data, e.g. to send from a worker process. '''
+        return dict(self.totals)
+
+    def merge(self, state):
+        ''' Adds recorded blocks from state(). '''
+
+        for kind, (count, maxBlocks, regions) in state.items():
+            total = self.totals[kind]
+            total[0] += count
+            total[1] = max(total[1], maxBlocks)
+            for region, blocks in regions.items():
+                total[2][region] += blocks
+
+    def report(self, stream=sys.stderr):
+        ''' Prints the mean blocks changed per command, for every command type and region. '''
+
+        stream.write("\nDisk blocks changed per command:\n")
+        stream.write("  {:<8} {:>8} {:>7} {:>5}".format("command", "count", "blocks", "max"))
+        stream.write("".join(" {:>12}".format(region) for region in REGION_NAMES) + "\n")
+
+        for kind in sorted(self.totals):
+            count, maxBlocks, regions = self.totals[kind]
+            stream.write("  {:<8} {:>8} {:>7.2f} {:>5}".format(kind, count, sum(regions.values()) / count, maxBlocks))
+            stream.write("".join(" {:>12.2f}".format(regions[region] / count) for region in REGION_NAMES) + "\n")
+
+# Block write log of this process.
+WRITES = WriteLog()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prints the disk blocks changed by each command, on a new file system.")
+    parser.add_argument("commands", nargs="+", help="commands, run in one shell")
+    args = parser.parse_args()
+    if cfg.DISK_LAYOUT is None:
+        parser.error("DISK_LAYOUT in config.py is not set")
+
+    # Imported here, sim_comms uses this module, and the log it uses is the one of the imported module.
+    from sim_comms import ShellSession
+    from block_writes import WRITES
+
+    cfg.compile()
+    region = block_regions(cfg.DISK_LAYOUT)
+    WRITES.enable()
+
+    try:
+        with ShellSession() as shell:
+            for command in args.commands:
+                before = shell.writes.last
+                shell.run(command)
+
+                blocks = changed_blocks(before, shell.writes.last)
+                print("{:<30} {:>4} blocks: {}".format(command, len(blocks),
+                      ", ".join("{} {}".format(region(num), num) for num in blocks)))
+    finally:
+        cfg.cleanup()
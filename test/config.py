@@ -6,8 +6,12 @@ Purpose: common configuration file for the file system tests.
 Date: 24.05.22
 '''
 
+import os
+import shutil
+import hashlib
 import pathlib
 import subprocess as process
+from phases import TIMER
 
 # Name of make target and exec. name to run.
 EXEC_NAME = "p6sh"
@@ -15,14 +19,184 @@ EXEC_NAME = "p6sh"
 # Absolute path to makefile and executable to run.
 PATH = str(pathlib.Path(__file__).parent.resolve()) + "/../" + "src"
 
+# Name of the disk image the simulator creates in PATH.
+DISK_NAME = "disk"
+
+# Layout of the disk image, None until filled in from the file system headers
+# of your precode (fs.h): block size and counts, where each region starts,
+# and the superblock, inode and directory entry structs. Checks reading the
+# disk image (--fsck, --writes, soak.py and the tests using it) are skipped
+# or refused while it is None. The keys:
+#
+#   block_size, inode_count, inode_size, data_count, root_inode, magic
+#   superblock, inode_bitmap, data_bitmap, inode_table, data_start (block numbers)
+#   superblock_fields, inode_fields, dirent_fields ([(name, struct code), ...])
+#   file_type, dir_type, null_block (inode type values and the unused pointer)
+#
+# The inode fields must include type, nlinks, size, direct (e.g. "8h") and
+# indirect, and the dirent fields name (e.g. "18s") and inode. Indirect blocks
+# hold pointers of the type of direct. Superblock fields are filled from the
+# layout key of the same name, or from an optional superblock_values dict
+# for other fields (e.g. {"free_blocks": 0}). Block numbers are absolute,
+# except block pointers in inodes which count from data_start.
+# Formats use the struct module, little-endian. Inodes are padded to inode_size.
+# Directory entries never cross a block: entry e is slot e % (block_size //
+# dirent size) of directory block e // (block_size // dirent size), and the
+# bytes after the last slot are unused. A directory's size is its number of
+# entries times the dirent size, not the bytes of its blocks.
+DISK_LAYOUT = None
+
+# Check the disk image with fsck after every test (python3 main.py --fsck).
+FSCK = False
+
+# Absolute path to the build cache, holding one compiled program per source hash.
+CACHE_PATH = str(pathlib.Path(__file__).parent.resolve()) + "/" + ".build_cache"
+
+# Most passed tests remembered by the result cache (see result_cache.py).
+RESULT_CACHE_SIZE = 1000
+
+# Files in PATH which affect the compiled program.
+SOURCE_SUFFIXES = (".c", ".h", ".s", ".S")
+SOURCE_FILES = ("Makefile", "makefile")
+
+# Environment variables holding compiler flags.
+FLAG_VARIABLES = ("CC", "CFLAGS", "CPPFLAGS", "LDFLAGS")
+
+# Absolute path to the program in use, and its source hash. Updated by compile().
+BINARY = PATH + "/" + EXEC_NAME
+BUILD_HASH = None
+
+# Build with gcov in PATH instead of using the cache (python3 main.py --coverage), and the make arguments adding it.
+COVERAGE = False
+COVERAGE_MAKE_ARGS = 'CC="gcc --coverage"'
+
+# Source hash of the instrumented program in PATH, None if there is none.
+COVERAGE_HASH = None
+
 # Max. time in seconds for one command to run.
 TIMEOUT = 20
 
+# Deadline of a command type: factor times its slowest time in earlier runs, at least MIN_DEADLINE seconds.
+DEADLINE_FACTOR = 10
+MIN_DEADLINE = 1.0
+
+# A shell waiting for input, with no output and no CPU time used for this many seconds, is hung.
+STALL_TIME = 0.3
+
+# Regular expression matching the shell prompt, printed when a command is done.
+PROMPT = r"\$ "
+
+def source_hash():
+    ''' Returns a hash of all source files in PATH, and the compiler flags. '''
+
+    digest = hashlib.sha256()
+
+    # Hash the make target and compiler flags.
+    digest.update(EXEC_NAME.encode())
+    for variable in FLAG_VARIABLES:
+        digest.update("{}={}\n".format(variable, os.environ.get(variable, "")).encode())
+
+    # Hash relative file names and content, in a stable order.
+    for root, dirs, files in os.walk(PATH):
+        dirs.sort()
+        for name in sorted(files):
+            if name not in SOURCE_FILES and not name.endswith(SOURCE_SUFFIXES):
+                continue
+            filePath = os.path.join(root, name)
+            digest.update(os.path.relpath(filePath, PATH).encode() + b"\0")
+            with open(filePath, "rb") as sourceFile:
+                digest.update(sourceFile.read())
+
+    return digest.hexdigest()
+
 def compile():
-    ''' Compiles the program, and sets correct permissions. '''
-    process.run("make clean; make " + EXEC_NAME, shell=True, cwd=PATH, stdout=process.DEVNULL, stderr=process.DEVNULL)
-    process.run("chmod +x ./" + EXEC_NAME, shell=True, cwd=PATH, stdout=process.DEVNULL, stderr=process.DEVNULL)
+    '''
+    Compiles the program if the source hash is not in the build cache, and
+    selects the cached program. With COVERAGE set, an instrumented program
+    is built and used in PATH instead. The disk image is reset, so every
+    test starts on a new file system.
+    '''
+
+    global BINARY, BUILD_HASH, COVERAGE_HASH
+
+    with TIMER.measure("compile"):
+        BUILD_HASH = source_hash()
+
+        # Instrumented programs write their counters next to the object files, so they are kept in PATH.
+        if COVERAGE:
+            if COVERAGE_HASH != BUILD_HASH:
+                process.run("make clean; make {} {}".format(EXEC_NAME, COVERAGE_MAKE_ARGS), shell=True, cwd=PATH,
+                            stdout=process.DEVNULL, stderr=process.DEVNULL)
+                if not os.path.exists(PATH + "/" + EXEC_NAME):
+                    raise RuntimeError("Could not compile {} with coverage in {}".format(EXEC_NAME, PATH))
+                COVERAGE_HASH = BUILD_HASH
+
+            BINARY = PATH + "/" + EXEC_NAME
+            reset_disk()
+            return
+        cacheDir = CACHE_PATH + "/" + BUILD_HASH
+        cached = cacheDir + "/" + EXEC_NAME
+
+        # Only compile on a cache miss.
+        if not os.path.exists(cached):
+            process.run("make clean; make " + EXEC_NAME, shell=True, cwd=PATH, stdout=process.DEVNULL, stderr=process.DEVNULL)
+            built = PATH + "/" + EXEC_NAME
+            if not os.path.exists(built):
+                raise RuntimeError("Could not compile {} in {}".format(EXEC_NAME, PATH))
+
+            # Copy in place atomically, other test processes may share the cache.
+            with AtomicFile(cached) as tmpName:
+                shutil.copy2(built, tmpName)
+                os.chmod(tmpName, 0o755)
+
+            # Remove object files from the source directory.
+            process.run("make clean", shell=True, cwd=PATH, stdout=process.DEVNULL, stderr=process.DEVNULL)
+
+        BINARY = cached
+        reset_disk()
+
+class AtomicFile:
+    '''
+    Context manager giving a temporary name to write a file under. When the
+    block ends, the file replaces path atomically, so other test processes
+    never read a partly written file. On errors it is removed instead.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmpName = "{}.{}.tmp".format(path, os.getpid())
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        return self.tmpName
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            os.replace(self.tmpName, self.path)
+        elif os.path.exists(self.tmpName):
+            os.remove(self.tmpName)
+
+def reset_disk():
+    ''' Removes the disk image, the simulator creates a new one on start. '''
+
+    try:
+        os.remove(PATH + "/" + DISK_NAME)
+    except FileNotFoundError:
+        pass
 
 def cleanup():
-    ''' Removes program and files. '''
-    process.run("make clean", shell=True, cwd=PATH, stdout=process.DEVNULL)
\ No newline at end of file
+    '''
+    Removes files made by a test. The compiled program is kept in the cache.
+    If FSCK is set, the disk image is checked first, and AssertionError is
+    raised if it is not consistent.
+    '''
+
+    try:
+        if FSCK and os.path.exists(PATH + "/" + DISK_NAME):
+            # Imported here, disk_image depends on this module.
+            from disk_image import check_disk
+            problems = check_disk(PATH + "/" + DISK_NAME)
+            if problems:
+                raise AssertionError("File system is inconsistent:\n  " + "\n  ".join(problems))
+    finally:
+        reset_disk()
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: per command deadlines learned from earlier runs, and hang detection.
+Date: 18.10.26
+
+Every command type gets a deadline of DEADLINE_FACTOR times the slowest
+latency seen in earlier runs, at least MIN_DEADLINE and at most TIMEOUT
+seconds. Unknown command types get TIMEOUT. Latencies are stored in
+CACHE_PATH, and shared by all builds. Streamed reads and writes of files
+(see sim_comms.py) take time by their size, so they get TIMEOUT per line,
+and are not stored.
+
+A shell is stalled when it and its children sleep, with no output and no
+CPU time used, for STALL_TIME seconds, i.e. it waits for input.
+'''
+
+import os
+import json
+import pexpect as process
+from collections import defaultdict
+import config as cfg
+
+# Latencies kept per command type.
+HISTORY_SIZE = 100
+
+# Latencies needed before a command type gets its own deadline.
+MIN_SAMPLES = 5
+
+class ShellHung(process.TIMEOUT):
+    ''' Raised when the shell simulator is hung, after it has been killed. '''
+
+    def __init__(self, command: str, reason: str):
+        super().__init__("{} hung on command {!r}: {}".format(cfg.EXEC_NAME, command, reason))
+        self.command = command
+        self.reason = reason
+
+def command_type(command: str):
+    ''' Returns the command type, i.e. the first word. '''
+
+    words = command.split()
+    return words[0] if words else ""
+
+def stat_fields(pid: int):
+    ''' Returns the fields of /proc/<pid>/stat after the program name, from field 3 on, or None if the process is gone. '''
+
+    try:
+        with open("/proc/{}/stat".format(pid)) as statFile:
+            stat = statFile.read()
+    except OSError:
+        return None
+
+    # The program name may contain spaces, fields after it are fixed.
+    return stat[stat.rindex(")") + 2:].split()
+
+def child_pids(pid: int):
+    ''' Returns the pids of the children of a process. '''
+
+    try:
+        with open("/proc/{0}/task/{0}/children".format(pid)) as childFile:
+            return [int(child) for child in childFile.read().split()]
+    except OSError:
+        pass
+
+    # Not in all kernels, look for the processes with pid as parent (field 4) instead.
+    children = []
+    for name in os.listdir("/proc"):
+        fields = stat_fields(name) if name.isdigit() else None
+        if fields is not None and int(fields[1]) == pid:
+            children.append(int(name))
+
+    return children
+
+def process_state(pid: int):
+    '''
+    Returns the state letter (e.g. "R" running, "S" sleeping) and the used
+    CPU time in clock ticks of a process and its children, or (None, None)
+    if not known. A process sleeping while a child runs (e.g. a wrapper
+    script starting the shell) gets the state of the child.
+    '''
+
+    fields = stat_fields(pid)
+    if fields is None:
+        return None, None
+
+    # Field 3 is the state, 14 and 15 are user and system time.
+    state, ticks = fields[0], int(fields[11]) + int(fields[12])
+
+    for child in child_pids(pid):
+        childState, childTicks = process_state(child)
+        if childState is None:
+            continue
+
+        ticks += childTicks
+        if state in ("S", "T", "t"):
+            state = childState
+
+    return state, ticks
+
+class DeadlineTable:
+    ''' Latency history per command type, used to set deadlines. '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.history = None
+
+        # Latencies seen by this process, not yet saved.
+        self.observed = defaultdict(list)
+
+    def load(self):
+        ''' Reads the stored latency history, once. '''
+
+        if self.history is not None:
+            return
+
+        try:
+            with open(self.path) as historyFile:
+                self.history = json.load(historyFile)
+        except (OSError, ValueError):
+            self.history = {}
+
+    def budget(self, command: str):
+        ''' Returns the deadline in seconds for one command. '''
+
+        self.load()
+        kind = command_type(command)
+        latencies = self.history.get(kind, []) + self.observed.get(kind, [])
+
+        # No deadline shorter than TIMEOUT before the command type is known.
+        if len(latencies) < MIN_SAMPLES:
+            return cfg.TIMEOUT
+
+        return min(cfg.TIMEOUT, max(cfg.MIN_DEADLINE, cfg.DEADLINE_FACTOR * max(latencies[-HISTORY_SIZE:])))
+
+    def observe(self, command: str, seconds: float):
+        ''' Stores the latency of a command that finished. '''
+
+        latencies = self.observed[command_type(command)]
+        latencies.append(seconds)
+        del latencies[:-HISTORY_SIZE]
+
+    def drain(self):
+        ''' Returns and forgets the latencies seen by this process, e.g. to send from a worker. '''
+
+        observed = dict(self.observed)
+        self.observed = defaultdict(list)
+
+        return observed
+
+    def merge(self, observed: dict):
+        ''' Adds latencies from drain(). '''
+
+        for kind, latencies in observed.items():
+            self.observed[kind] += latencies
+            del self.observed[kind][:-HISTORY_SIZE]
+
+    def save(self):
+        ''' Adds the latencies seen by this process to the stored history. '''
+
+        if not self.observed:
+            return
+
+        self.load()
+        for kind, latencies in self.drain().items():
+            self.history[kind] = (self.history.get(kind, []) + latencies)[-HISTORY_SIZE:]
+
+        with cfg.AtomicFile(self.path) as tmpName, open(tmpName, "w") as historyFile:
+            json.dump(self.history, historyFile)
+
+# Deadlines of this process.
+DEADLINES = DeadlineTable(cfg.CACHE_PATH + "/deadlines.json")
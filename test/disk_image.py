@@ -0,0 +1,319 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: reads the simulator's disk image directly, and checks that it is consistent (fsck).
+Date: 18.10.26
+
+The image is memory-mapped, and records are decoded in place with
+struct.unpack_from, so nothing but the decoded values is copied. The layout
+is described by DISK_LAYOUT in config.py, and must match your fs.h. It is
+not set by default, see config.py.
+'''
+
+import os
+import re as regex
+import mmap
+import struct
+from collections import Counter
+import config as cfg
+
+def disk_layout(layout: dict = None):
+    ''' Returns layout, or DISK_LAYOUT in config.py if None. Raises ValueError if neither is set. '''
+
+    layout = layout if layout is not None else cfg.DISK_LAYOUT
+    if layout is None:
+        raise ValueError("DISK_LAYOUT in config.py is not set, fill it in from the file system headers (fs.h)")
+
+    return layout
+
+def dirent_position(layout: dict, entry: int):
+    '''
+    Returns the directory block index (from the directory's first block) and
+    the byte offset in that block of a directory entry, see DISK_LAYOUT.
+    '''
+
+    direntSize = struct.calcsize("<" + "".join(code for name, code in layout["dirent_fields"]))
+    perBlock = layout["block_size"] // direntSize
+
+    return entry // perBlock, (entry % perBlock) * direntSize
+
+class RecordFormat:
+    '''
+    A struct format with named fields, e.g. [("size", "i"), ("direct", "8h")].
+    Fields with a count (like "8h") are lists, other fields single values.
+    Records may be padded to a larger size.
+    '''
+
+    def __init__(self, fields: list, size: int = None):
+        self.fields = []
+
+        # Field name -> struct code of one value, e.g. "h" for "8h" and "18s" for "18s".
+        self.codes = {}
+
+        for name, code in fields:
+            count, kind = regex.fullmatch(r"(\d*)(\w)", code).groups()
+            isList = count != "" and kind not in ("s", "p")
+            self.fields.append((name, int(count) if isList else 1, isList))
+            self.codes[name] = kind if isList else code
+
+        self.struct = struct.Struct("<" + "".join(code for name, code in fields))
+        self.size = size if size is not None else self.struct.size
+
+    def count(self, name: str):
+        ''' Returns the number of values in a field, e.g. 8 for "8h" and 1 for "18s". '''
+
+        for field, count, isList in self.fields:
+            if field == name:
+                return count
+
+        raise ValueError("record has no field {!r}".format(name))
+
+    def value_size(self, name: str):
+        ''' Returns the size in bytes of one value of a field, e.g. 2 for "8h" and 18 for "18s". '''
+        return struct.calcsize("<" + self.codes[name])
+
+    def unpack(self, buffer, offset: int):
+        ''' Returns the record at offset in buffer as a dictionary. '''
+
+        values = self.struct.unpack_from(buffer, offset)
+        record = {}
+        num = 0
+
+        for name, count, isList in self.fields:
+            record[name] = list(values[num:num + count]) if isList else values[num]
+            num += count
+
+        return record
+
+    def pack_into(self, buffer, offset: int, record: dict):
+        ''' Stores a record (dictionary) at offset in buffer. '''
+
+        values = []
+        for name, count, isList in self.fields:
+            values += record[name] if isList else [record[name]]
+
+        self.struct.pack_into(buffer, offset, *values)
+
+def pointer_format(layout: dict):
+    ''' Returns the struct of an indirect block: as many block pointers as fit, of the type of the direct pointers. '''
+
+    code = RecordFormat(layout["inode_fields"]).codes["direct"]
+    return struct.Struct("<{}{}".format(layout["block_size"] // struct.calcsize("<" + code), code))
+
+class DiskImage:
+    ''' Memory-mapped disk image. Use in a "with" statement, or call close(). '''
+
+    def __init__(self, path: str, layout: dict = None, writable: bool = False):
+        self.layout = disk_layout(layout)
+        self.blockSize = self.layout["block_size"]
+
+        self.superblockFormat = RecordFormat(self.layout["superblock_fields"])
+        self.inodeFormat = RecordFormat(self.layout["inode_fields"], self.layout["inode_size"])
+        self.direntFormat = RecordFormat(self.layout["dirent_fields"])
+        self.pointerFormat = pointer_format(self.layout)
+
+        # Map the whole image, the data is only read when used.
+        self.file = open(path, "r+b" if writable else "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        ''' Unmaps and closes the image. '''
+
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def size_needed(self):
+        ''' Returns the smallest image size in bytes holding all regions of the layout. '''
+        return (self.layout["data_start"] + self.layout["data_count"]) * self.blockSize
+
+    def block(self, num: int):
+        ''' Returns an (absolute) block as a memoryview, without copying. '''
+        return self.view[num * self.blockSize:(num + 1) * self.blockSize]
+
+    def superblock(self):
+        ''' Returns the superblock as a dictionary. '''
+        return self.superblockFormat.unpack(self.view, self.layout["superblock"] * self.blockSize)
+
+    def bitmap_bit(self, start: int, num: int):
+        ''' Returns bit num of the bitmap starting in block start. Bit 0 is the lowest bit of byte 0. '''
+        return (self.view[start * self.blockSize + num // 8] >> (num % 8)) & 1 == 1
+
+    def inode_used(self, num: int):
+        ''' Returns True if the inode is marked in use in the inode bitmap. '''
+        return self.bitmap_bit(self.layout["inode_bitmap"], num)
+
+    def data_used(self, num: int):
+        ''' Returns True if the data block is marked in use in the data bitmap. '''
+        return self.bitmap_bit(self.layout["data_bitmap"], num)
+
+    def inode_offset(self, num: int):
+        ''' Returns the byte offset of an inode in the image. '''
+        return self.layout["inode_table"] * self.blockSize + num * self.inodeFormat.size
+
+    def inode(self, num: int):
+        ''' Returns an inode as a dictionary. '''
+        return self.inodeFormat.unpack(self.view, self.inode_offset(num))
+
+    def pointers(self, num: int):
+        ''' Returns the block pointers stored in an indirect (data) block. '''
+        return list(self.pointerFormat.unpack_from(self.view, (self.layout["data_start"] + num) * self.blockSize))
+
+    def blocks(self, inode: dict):
+        '''
+        Returns the data blocks of an inode in file order, and its indirect
+        block or None. Null pointers are left out.
+        '''
+
+        null = self.layout["null_block"]
+        blocks = [block for block in inode["direct"] if block != null]
+        indirect = inode["indirect"] if inode["indirect"] != null else None
+
+        if indirect is not None and 0 <= indirect < self.layout["data_count"]:
+            blocks += [block for block in self.pointers(indirect) if block != null]
+
+        return blocks, indirect
+
+    def entries(self, num: int):
+        ''' Returns the entries of a directory inode as a list of (name, inode number). '''
+
+        inode = self.inode(num)
+        blocks, indirect = self.blocks(inode)
+        entries = []
+
+        # The directory size tells how many entries are used.
+        for entry in range(inode["size"] // self.direntFormat.size):
+            index, position = dirent_position(self.layout, entry)
+            offset = (self.layout["data_start"] + blocks[index]) * self.blockSize + position
+            dirent = self.direntFormat.unpack(self.view, offset)
+            name = dirent["name"].split(b"\0")[0].decode("utf-8", errors="replace")
+            entries.append((name, dirent["inode"]))
+
+        return entries
+
+    def walk(self):
+        ''' Yields (path, inode number) of every file and directory reachable from root. '''
+
+        stack = [("/", self.layout["root_inode"])]
+        seen = set()
+
+        while stack:
+            path, num = stack.pop()
+            if num in seen:
+                continue
+            seen.add(num)
+            yield path, num
+
+            if self.inode(num)["type"] == self.layout["dir_type"]:
+                for name, child in self.entries(num):
+                    if name not in (".", ".."):
+                        stack.append((path.rstrip("/") + "/" + name, child))
+
+def fsck(image: DiskImage):
+    '''
+    Checks that the file system in an image is consistent, and returns a list
+    of problems (empty if none): superblock, reachable inodes and their link
+    counts, block pointers, and agreement between bitmaps and what is used.
+    '''
+
+    layout = image.layout
+    problems = []
+
+    if len(image.view) < image.size_needed():
+        return ["disk image is {} bytes, the layout needs {}".format(len(image.view), image.size_needed())]
+
+    superblock = image.superblock()
+    if superblock.get("magic") != layout["magic"]:
+        problems.append("superblock magic is {:#x}, expected {:#x}".format(superblock.get("magic", 0), layout["magic"]))
+
+    root = layout["root_inode"]
+    references = Counter({root: 0})
+    blockOwners = {}
+    seen = set()
+    stack = [(root, root)]
+
+    # Walk all directories from root.
+    while stack:
+        num, parent = stack.pop()
+        if num in seen:
+            continue
+        seen.add(num)
+
+        if not 0 <= num < layout["inode_count"]:
+            problems.append("invalid inode number {}".format(num))
+            continue
+        if not image.inode_used(num):
+            problems.append("inode {} is in use, but free in the inode bitmap".format(num))
+
+        inode = image.inode(num)
+        if inode["type"] not in (layout["file_type"], layout["dir_type"]):
+            problems.append("inode {} has invalid type {}".format(num, inode["type"]))
+            continue
+
+        # Check the block pointers, and the data bitmap.
+        blocks, indirect = image.blocks(inode)
+        for block in blocks + ([indirect] if indirect is not None else []):
+            if not 0 <= block < layout["data_count"]:
+                problems.append("inode {} points to invalid block {}".format(num, block))
+            elif block in blockOwners:
+                problems.append("block {} is used by inode {} and {}".format(block, blockOwners[block], num))
+            else:
+                blockOwners[block] = num
+                if not image.data_used(block):
+                    problems.append("block {} is used by inode {}, but free in the data bitmap".format(block, num))
+
+        if inode["size"] < 0 or inode["size"] > len(blocks) * image.blockSize:
+            problems.append("inode {} has size {} but {} blocks".format(num, inode["size"], len(blocks)))
+            continue
+
+        if inode["type"] != layout["dir_type"]:
+            continue
+
+        # Count every directory entry as a link, including "." and "..".
+        for name, child in image.entries(num):
+            references[child] += 1
+
+            if name == "." and child != num:
+                problems.append("directory inode {} has \".\" pointing to {}".format(num, child))
+            elif name == ".." and child != parent:
+                problems.append("directory inode {} has \"..\" pointing to {}, expected {}".format(num, child, parent))
+            elif name not in (".", ".."):
+                stack.append((child, num))
+
+    # Link counts must match the directory entries.
+    for num in sorted(seen):
+        if 0 <= num < layout["inode_count"]:
+            nlinks = image.inode(num)["nlinks"]
+            if nlinks != references[num]:
+                problems.append("inode {} has {} links, but {} directory entries".format(num, nlinks, references[num]))
+
+    # Everything marked in use must be reachable.
+    for num in range(layout["inode_count"]):
+        if image.inode_used(num) and num not in seen:
+            problems.append("inode {} is marked in use, but not reachable from root".format(num))
+
+    for block in range(layout["data_count"]):
+        if image.data_used(block) and block not in blockOwners:
+            problems.append("block {} is marked in use, but not used by any inode".format(block))
+
+    return problems
+
+def check_disk(path: str):
+    ''' Runs fsck on the disk image at path, and returns a list of problems. '''
+
+    if os.path.getsize(path) == 0:
+        return ["disk image is empty"]
+
+    with DiskImage(path) as image:
+        try:
+            return fsck(image)
+        except (struct.error, IndexError) as error:
+            return ["disk image could not be read: {}".format(error)]
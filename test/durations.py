@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: test durations from earlier runs, used to run the longest tests first and to split tests into shards.
+Date: 18.10.26
+
+Parallel workers take the tests longest first, so a slow test never starts
+last. With "python3 main.py --shard 2/4" the tests are split into four
+shards of about the same total time (longest first, each test to the
+shard with the least time so far), and only the second is run. Every CI
+job must use the same durations file (--durations), or the shards may
+overlap, so sharded runs do not change it, only full runs do. Tests with
+no history get the median duration of the others.
+'''
+
+import json
+import heapq
+import statistics
+import config as cfg
+
+# Durations kept per test.
+HISTORY_SIZE = 10
+
+# Seconds assumed for a test when no test has a history.
+DEFAULT_DURATION = 1.0
+
+def parse_shard(text: str):
+    ''' Returns (index, count) of a shard given as "i/N", with i from 1 to N. Raises ValueError if not valid. '''
+
+    index, _, count = text.partition("/")
+    index, count = int(index), int(count)
+
+    if not 1 <= index <= count:
+        raise ValueError("shard must be i/N with 1 <= i <= N, not {!r}".format(text))
+
+    return index, count
+
+class DurationTable:
+    ''' Duration history per test id. '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+        try:
+            with open(path) as historyFile:
+                self.history = json.load(historyFile)
+        except (OSError, ValueError):
+            self.history = {}
+
+    def estimate(self, testId: str):
+        ''' Returns the expected duration of a test in seconds. '''
+
+        if testId in self.history:
+            return statistics.median(self.history[testId])
+
+        known = [statistics.median(durations) for durations in self.history.values()]
+        return statistics.median(known) if known else DEFAULT_DURATION
+
+    def longest_first(self, tests: list):
+        ''' Returns the tests (or test ids) sorted by expected duration, longest first, then by id. '''
+
+        def key(test):
+            testId = test if isinstance(test, str) else test.id()
+            return -self.estimate(testId), testId
+
+        return sorted(tests, key=key)
+
+    def split(self, tests: list, count: int):
+        '''
+        Splits tests into count shards of about the same expected time,
+        and returns a list of shards, each in the order of tests.
+        '''
+
+        # Longest first, every test to the shard with the least time so far.
+        loads = [(0.0, num) for num in range(count)]
+        assigned = {}
+
+        for test in self.longest_first(tests):
+            load, num = heapq.heappop(loads)
+            assigned[test.id()] = num
+            heapq.heappush(loads, (load + self.estimate(test.id()), num))
+
+        return [[test for test in tests if assigned[test.id()] == num] for num in range(count)]
+
+    def shard(self, tests: list, index: int, count: int):
+        ''' Returns the tests of shard index (from 1) of count. '''
+        return self.split(tests, count)[index - 1]
+
+    def record(self, records: list):
+        ''' Adds the durations of tests which ran (see phases.test_record). '''
+
+        for record in records:
+            if record["outcome"] in ("ok", "fail", "error", "expected failure", "unexpected success"):
+                self.history[record["id"]] = (self.history.get(record["id"], []) + [record["seconds"]])[-HISTORY_SIZE:]
+
+    def save(self):
+        ''' Stores the history. '''
+
+        with cfg.AtomicFile(self.path) as tmpName, open(tmpName, "w") as historyFile:
+            json.dump(self.history, historyFile, indent=1, sort_keys=True)
+
+# Durations of this suite, in the build cache unless given with --durations.
+DURATIONS = DurationTable(cfg.CACHE_PATH + "/durations.json")
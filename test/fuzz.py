@@ -0,0 +1,423 @@
+#!/usr/bin/python3
+
+'''
+Random testing of the file system, checked against a model in Python.
+
+Written by: Isak Kjerstad.
+Purpose: runs random shell commands, and compares every result with a reference model.
+Date: 18.10.26
+
+The model keeps the directory tree, file contents and link counts, and
+knows the error code each command should give (see validate_output). All
+commands of a session run in one shell, and the shell is restarted on the
+same disk image now and then, to check that the state is stored. Only
+behaviour given by the error codes and the other tests is checked, e.g.
+directory sizes are not.
+
+Run: "python3 fuzz.py" to run 2000 random commands.
+Run: "python3 fuzz.py --seed 7 --operations 10000" to run another sequence.
+A failure prints the seed and the commands leading up to it.
+'''
+
+import sys
+import random
+import argparse
+import config as cfg
+from collections import Counter
+from output_parser import OutputIndex, parse_pwd
+from disk_image import RecordFormat
+from sim_comms import ShellSession, split_words
+from deadlines import DEADLINES
+
+# Names used, few so commands often hit existing files.
+NAMES = ["a", "b", "c", "d", "docs", "src", "tmp", "f1", "f2", "note", "my-file", "dir_3"]
+
+# A name the other tests expect to be too long (see test_open.py), used when DISK_LAYOUT is not set.
+TOO_LONG_NAME = "my_name_is_too_long"
+
+# Words used in file contents.
+WORDS = ["Hello", "World!", "fuzz", "data", "block", "inode", "0123456789", "P6"]
+
+# Most files and directories at a time, keeps the model within the disk size.
+MAX_NODES = 60
+
+# Most lines in a file, about 1500 bytes.
+MAX_LINES = 60
+
+class Node:
+    ''' A file (content is a str) or a directory (children is a dictionary) in the model. '''
+
+    def __init__(self, parent=None, content: str = None):
+        self.parent = parent
+        self.content = content
+        self.children = {} if content is None else None
+
+        # Names of a file, directories count their own.
+        self.nlinks = 0
+
+    def is_dir(self):
+        return self.children is not None
+
+    def links(self):
+        ''' Returns the link count: names of a file, or ".", the parent entry and every ".." of a directory. '''
+
+        if self.is_dir():
+            return 2 + sum(1 for child in self.children.values() if child.is_dir())
+
+        return self.nlinks
+
+class ModelFS:
+    ''' Reference model of the file system. '''
+
+    def __init__(self):
+        self.root = Node()
+        self.root.parent = self.root
+        self.cwd = self.root
+        self.path = []
+        self.nodes = 1
+
+        # Longest name allowed, the name field holds a terminating zero byte. Without a
+        # layout, only names in NAMES and names as long as TOO_LONG_NAME are used.
+        if cfg.DISK_LAYOUT is not None:
+            self.maxName = RecordFormat(cfg.DISK_LAYOUT["dirent_fields"]).value_size("name") - 1
+        else:
+            self.maxName = len(TOO_LONG_NAME) - 1
+
+    def restart(self):
+        ''' A new shell starts in root. '''
+        self.cwd = self.root
+        self.path = []
+
+    def lookup(self, path: str):
+        ''' Returns (node, error code) of a path. '''
+
+        node = self.root if path.startswith("/") else self.cwd
+
+        for part in [part for part in path.split("/") if part]:
+            if not node.is_dir():
+                return None, -19
+            if len(part) > self.maxName:
+                return None, -4
+            if part == "..":
+                node = node.parent
+            elif part != ".":
+                if part not in node.children:
+                    return None, -5
+                node = node.children[part]
+
+        return node, 0
+
+    def path_of(self, node: Node):
+        ''' Returns the absolute path of a directory. '''
+
+        parts = []
+        while node is not self.root:
+            parts.append(next(name for name, child in node.parent.children.items() if child is node))
+            node = node.parent
+
+        return "/" + "/".join(reversed(parts))
+
+    def directories(self):
+        ''' Returns all directories. '''
+
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            found.append(node)
+            stack += [child for child in node.children.values() if child.is_dir()]
+
+        return found
+
+    def files(self):
+        ''' Returns the absolute paths of all files. '''
+
+        return [(self.path_of(node).rstrip("/") + "/" + name, child)
+                for node in self.directories() for name, child in node.children.items() if not child.is_dir()]
+
+    def new_name_error(self, name: str):
+        ''' Returns the error code of adding a name to the current directory. '''
+
+        if len(name) > self.maxName:
+            return -4
+        if name in self.cwd.children:
+            return -9
+
+        return 0
+
+class Divergence(Exception):
+    ''' The shell and the model disagree. '''
+
+    def __init__(self, seed: int, num: int, command: str, problem: str, history: list):
+        super().__init__("Seed {}, command {} {!r}: {}\nLast commands:\n  {}".format(
+                         seed, num, command, problem, "\n  ".join(history[-20:])))
+        self.command = command
+        self.problem = problem
+
+class Fuzzer:
+    ''' Chooses random commands, runs them in a shell and checks them with the model. '''
+
+    def __init__(self, seed: int, shell: ShellSession):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.shell = shell
+        self.model = ModelFS()
+        self.history = []
+        self.count = 0
+
+    def name(self):
+        ''' Returns a random name, sometimes one that is too long. '''
+
+        if self.rng.random() < 0.03:
+            return "x" * (self.model.maxName + 1)
+
+        return self.rng.choice(NAMES)
+
+    def lines(self):
+        ''' Returns random file content as a list of lines. '''
+
+        return [" ".join(self.rng.choice(WORDS) + str(self.rng.randrange(100)) for _ in range(self.rng.randrange(1, 6)))
+                for _ in range(self.rng.randrange(0, self.rng.choice([3, MAX_LINES])))]
+
+    def run(self, command: str, strLines: list = None):
+        ''' Runs a command, and returns the output as an index. '''
+
+        self.count += 1
+        self.history.append(command if strLines is None else "{} ({} lines)".format(command, len(strLines)))
+
+        if strLines is None:
+            output = self.shell.run(command)
+        else:
+            output = self.shell.write_stream(command[4:], strLines)[0]
+
+        return OutputIndex(split_words(output))
+
+    def check(self, command: str, index: OutputIndex, error: int, problem: str = None):
+        ''' Raises Divergence if the error code, or a check of the output, is wrong. '''
+
+        if index.first_error() != error:
+            problem = "error code {}, expected {}".format(index.first_error(), error)
+
+        if problem is not None:
+            raise Divergence(self.seed, self.count, command, problem, self.history)
+
+    def step(self):
+        ''' Runs one random command. '''
+
+        model = self.model
+        full = model.nodes >= MAX_NODES
+        operation = self.rng.choices(["mkdir", "cd", "cat", "more", "ln", "rm", "rmdir", "stat", "ls", "pwd"],
+                                     [3 * (not full), 4, 4 * (not full), 2, 2 * (not full), 3, 3, 2, 2, 1])[0]
+        getattr(self, "do_" + operation)()
+
+    def do_mkdir(self):
+        name = self.name()
+        error = self.model.new_name_error(name)
+        self.check("mkdir " + name, self.run("mkdir " + name), error)
+
+        if error == 0:
+            self.model.cwd.children[name] = Node(self.model.cwd)
+            self.model.nodes += 1
+
+    def do_cd(self):
+        model = self.model
+        choice = self.rng.random()
+
+        # Relative, parent, root or absolute paths.
+        if choice < 0.4:
+            path = self.name()
+        elif choice < 0.6:
+            path = ".."
+        elif choice < 0.7:
+            path = "/"
+        else:
+            path = model.path_of(self.rng.choice(model.directories()))
+
+        node, error = model.lookup(path)
+        if error == 0 and not node.is_dir():
+            error = -19
+
+        self.check("cd " + path, self.run("cd " + path), error)
+
+        if error == 0:
+            model.cwd = node
+            model.path = [part for part in model.path_of(node).split("/") if part]
+
+    def do_cat(self):
+        model = self.model
+        name = self.name()
+        node = model.cwd.children.get(name)
+
+        # What cat does with a directory is not given.
+        if node is not None and node.is_dir():
+            return
+
+        strLines = self.lines()
+        error = -4 if len(name) > model.maxName else 0
+        self.check("cat " + name, self.run("cat " + name, strLines), error)
+
+        if error == 0:
+            if node is None:
+                node = model.cwd.children[name] = Node(model.cwd, "")
+                node.nlinks = 1
+                model.nodes += 1
+            node.content = "".join(line + "\n" for line in strLines)
+
+    def do_more(self):
+        name = self.name()
+        node, error = self.model.lookup(name)
+
+        # What more does with a directory is not given.
+        if node is not None and node.is_dir():
+            return
+
+        command = "more " + name
+        index = self.run(command)
+        problem = None
+
+        if error == 0 and index.missing(node.content.split()):
+            problem = "missing words {}".format(index.missing(node.content.split())[:5])
+
+        self.check(command, index, error, problem)
+
+    def do_ln(self):
+        model = self.model
+        files = model.files()
+        name = self.name()
+
+        # Link to a file by name or path, or to a name that may not exist.
+        if files and self.rng.random() < 0.8:
+            path, target = self.rng.choice(files)
+            if self.rng.random() < 0.5 and model.cwd.children.get(path.rsplit("/", 1)[1]) is target:
+                path = path.rsplit("/", 1)[1]
+        else:
+            path = self.name()
+
+        # What ln does with a directory is not given.
+        target, error = model.lookup(path)
+        if target is not None and target.is_dir():
+            return
+        if error == 0:
+            error = model.new_name_error(name)
+
+        command = "ln {} {}".format(name, path)
+        self.check(command, self.run(command), error)
+
+        if error == 0:
+            model.cwd.children[name] = target
+            target.nlinks += 1
+
+    def do_rm(self):
+        name = self.name()
+        node, error = self.model.lookup(name)
+
+        # What rm does with a directory is not given.
+        if node is not None and node.is_dir():
+            return
+
+        self.check("rm " + name, self.run("rm " + name), error)
+
+        if error == 0:
+            del self.model.cwd.children[name]
+            node.nlinks -= 1
+            self.model.nodes -= node.nlinks == 0
+
+    def do_rmdir(self):
+        name = self.name()
+        node, error = self.model.lookup(name)
+
+        # What rmdir does with a file is not given.
+        if node is not None and not node.is_dir():
+            return
+
+        if error == 0 and node.children:
+            error = -11
+        self.check("rmdir " + name, self.run("rmdir " + name), error)
+
+        if error == 0:
+            del self.model.cwd.children[name]
+            self.model.nodes -= 1
+
+    def do_stat(self):
+        name = self.name()
+        node, error = self.model.lookup(name)
+        command = "stat " + name
+        index = self.run(command)
+        problem = None
+
+        # Stat prints the link count and, for files, the size.
+        if error == 0:
+            numbers = Counter(index.stats.get(name, []))
+            expected = Counter([node.links()] + ([len(node.content.encode())] if not node.is_dir() else []))
+            if expected - numbers:
+                problem = "stat printed {}, expected links {} and size {}".format(
+                          index.stats.get(name), node.links(), None if node.is_dir() else len(node.content.encode()))
+
+        self.check(command, index, error, problem)
+
+    def do_ls(self):
+        index = self.run("ls")
+        children = self.model.cwd.children
+        problem = None
+
+        # All names in the directory, and none of the others.
+        missing = index.missing([".", ".."] + list(children))
+        extra = [name for name in NAMES if name not in children and index.words[name] > 0]
+        if missing or extra:
+            problem = "ls is missing {}, and shows removed {}".format(missing, extra)
+
+        self.check("ls", index, 0, problem)
+
+    def do_pwd(self):
+        index = self.run("pwd")
+        path = "/" + "/".join(self.model.path)
+        shown = parse_pwd(" ".join(index.words.elements()))
+        problem = "pwd printed {}, expected {}".format(shown, path) if shown != path else None
+
+        self.check("pwd", index, 0, problem)
+
+def fuzz(seed: int = 0, operations: int = 2000, sessionLength: int = 500):
+    '''
+    Runs random commands on a new disk image, in shells of sessionLength
+    commands each. Raises Divergence when the shell and the model disagree,
+    and returns the number of commands run.
+    '''
+
+    cfg.compile()
+    fuzzer = None
+
+    try:
+        while fuzzer is None or fuzzer.count < operations:
+            with ShellSession() as shell:
+                if fuzzer is None:
+                    fuzzer = Fuzzer(seed, shell)
+
+                # A new shell on the same disk image starts in root.
+                fuzzer.shell = shell
+                fuzzer.model.restart()
+                fuzzer.history.append("<restart>")
+
+                end = min(operations, fuzzer.count + sessionLength)
+                while fuzzer.count < end:
+                    fuzzer.step()
+    finally:
+        cfg.cleanup()
+
+    return fuzzer.count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Random testing of the file system.")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed runs the same commands")
+    parser.add_argument("--operations", type=int, default=2000, help="commands to run")
+    parser.add_argument("--session-length", type=int, default=500, help="commands per shell")
+    args = parser.parse_args()
+
+    try:
+        count = fuzz(args.seed, args.operations, args.session_length)
+    except Divergence as error:
+        print(error)
+        sys.exit(1)
+    finally:
+        DEADLINES.save()
+
+    print("{} commands, no differences.".format(count))
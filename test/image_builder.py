@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: builds disk images straight from a description of the file tree.
+Date: 18.10.26
+
+A tree is a dictionary of names. A dictionary value is a directory, a str or
+bytes value is a file with that content, and a HardLink value is another
+name for an existing file. For example:
+
+    tree = {"docs": {"a.txt": "Hello World!\\n"}, "alias": HardLink("/docs/a.txt")}
+    write_image(tree)
+
+The image uses DISK_LAYOUT in config.py (which must be set), with directory
+entries placed as described there, so the simulator can read it with its
+own ls, cd and more commands. A tree with thousands of entries is
+built in milliseconds, compared to seconds of shell commands.
+'''
+
+import config as cfg
+from disk_image import RecordFormat, dirent_position, disk_layout, pointer_format
+
+class HardLink:
+    ''' Another name for the file at an absolute path in the tree. '''
+
+    def __init__(self, target: str):
+        self.target = target
+
+class ImageBuilder:
+    ''' Builds one disk image in memory, see build_image(). '''
+
+    def __init__(self, layout: dict):
+        self.layout = layout
+        self.blockSize = layout["block_size"]
+        self.superblockFormat = RecordFormat(layout["superblock_fields"])
+        self.inodeFormat = RecordFormat(layout["inode_fields"], layout["inode_size"])
+        self.direntFormat = RecordFormat(layout["dirent_fields"])
+        self.pointerFormat = pointer_format(layout)
+
+        # The name field holds a terminating zero byte.
+        self.maxName = self.direntFormat.value_size("name") - 1
+
+        self.image = bytearray((layout["data_start"] + layout["data_count"]) * self.blockSize)
+        self.nextInode = 0
+        self.nextBlock = 0
+
+        # Inode number -> file content, or list of directory entries (name, inode number or HardLink).
+        self.contents = {}
+        self.paths = {}
+
+    def new_inode(self):
+        ''' Returns the next free inode number. Root is given its own number. '''
+
+        if self.nextInode == self.layout["root_inode"] and self.contents:
+            self.nextInode += 1
+        if self.nextInode >= self.layout["inode_count"]:
+            raise ValueError("out of inodes, the layout has {}".format(self.layout["inode_count"]))
+
+        self.nextInode += 1
+        return self.nextInode - 1
+
+    def new_blocks(self, count: int):
+        ''' Returns count free data block numbers. '''
+
+        if self.nextBlock + count > self.layout["data_count"]:
+            raise ValueError("out of data blocks, the layout has {}".format(self.layout["data_count"]))
+
+        self.nextBlock += count
+        return list(range(self.nextBlock - count, self.nextBlock))
+
+    def add_directory(self, tree: dict, num: int, parent: int, path: str):
+        ''' Gives inode numbers to everything in a directory tree. '''
+
+        self.paths[path] = num
+        entries = [(".", num), ("..", parent)]
+        self.contents[num] = entries
+
+        for name, value in tree.items():
+            if not 0 < len(name.encode()) <= self.maxName or "/" in name or name in (".", ".."):
+                raise ValueError("invalid file name {!r} in {}".format(name, path))
+
+            childPath = path.rstrip("/") + "/" + name
+
+            if isinstance(value, HardLink):
+                entries.append((name, value))
+            elif isinstance(value, dict):
+                child = self.new_inode()
+                entries.append((name, child))
+                self.add_directory(value, child, num, childPath)
+            else:
+                child = self.new_inode()
+                entries.append((name, child))
+                self.paths[childPath] = child
+                self.contents[child] = value.encode() if isinstance(value, str) else bytes(value)
+
+    def resolve(self):
+        ''' Replaces hard links by inode numbers, and returns the link count of every inode. '''
+
+        nlinks = dict.fromkeys(self.contents, 0)
+
+        for num, entries in self.contents.items():
+            if not isinstance(entries, list):
+                continue
+
+            for index, (name, child) in enumerate(entries):
+                if isinstance(child, HardLink):
+                    target = self.paths.get(child.target)
+                    if target is None or isinstance(self.contents[target], list):
+                        raise ValueError("hard link {!r} must name an existing file".format(child.target))
+                    child = target
+                    entries[index] = (name, child)
+
+                nlinks[child] += 1
+
+        return nlinks
+
+    def store(self, num: int, data: bytes):
+        ''' Writes data to new blocks, and returns the direct and indirect block pointers. '''
+
+        null = self.layout["null_block"]
+        direct = [null] * self.inodeFormat.count("direct")
+        count = -(-len(data) // self.blockSize)
+        blocks = self.new_blocks(count)
+
+        for index, block in enumerate(blocks):
+            offset = (self.layout["data_start"] + block) * self.blockSize
+            chunk = data[index * self.blockSize:(index + 1) * self.blockSize]
+            self.image[offset:offset + len(chunk)] = chunk
+
+        # Direct pointers first, the rest in one indirect block.
+        direct[:min(count, len(direct))] = blocks[:len(direct)]
+        rest = blocks[len(direct):]
+        indirect = null
+
+        if rest:
+            perBlock = self.blockSize // self.inodeFormat.value_size("direct")
+            if len(rest) > perBlock:
+                raise ValueError("inode {} needs {} blocks, the maximum is {}".format(num, count, len(direct) + perBlock))
+            indirect = self.new_blocks(1)[0]
+            self.pointerFormat.pack_into(self.image, (self.layout["data_start"] + indirect) * self.blockSize,
+                                         *(rest + [null] * (perBlock - len(rest))))
+
+        return direct, indirect
+
+    def superblock_value(self, name: str):
+        ''' Returns the value of a superblock field, from superblock_values in the layout, or the layout key of that name. '''
+
+        values = self.layout.get("superblock_values", {})
+        if name in values:
+            return values[name]
+        if name in self.layout:
+            return self.layout[name]
+
+        raise ValueError("superblock field {!r} is not a layout key, give it in superblock_values".format(name))
+
+    def set_bit(self, start: int, num: int):
+        ''' Marks bit num of the bitmap starting in block start. '''
+        self.image[start * self.blockSize + num // 8] |= 1 << (num % 8)
+
+    def build(self, tree: dict):
+        ''' Returns the image of a tree as a bytearray. '''
+
+        root = self.layout["root_inode"]
+        self.add_directory(tree, root, root, "/")
+        nlinks = self.resolve()
+
+        for num, content in sorted(self.contents.items()):
+            if isinstance(content, list):
+                # Entries never cross a block, and size tells how many there are (see DISK_LAYOUT).
+                kind = self.layout["dir_type"]
+                data = self.directory_data(content)
+                size = len(content) * self.direntFormat.size
+            else:
+                kind = self.layout["file_type"]
+                data = content
+                size = len(content)
+
+            direct, indirect = self.store(num, data)
+            inode = {name: ([0] * count if isList else 0)
+                     for name, count, isList in self.inodeFormat.fields}
+            inode.update({"type": kind, "nlinks": nlinks[num], "size": size, "direct": direct, "indirect": indirect})
+            self.inodeFormat.pack_into(self.image, self.layout["inode_table"] * self.blockSize + num * self.inodeFormat.size, inode)
+            self.set_bit(self.layout["inode_bitmap"], num)
+
+        for block in range(self.nextBlock):
+            self.set_bit(self.layout["data_bitmap"], block)
+
+        superblock = {name: self.superblock_value(name) for name, count, isList in self.superblockFormat.fields}
+        self.superblockFormat.pack_into(self.image, self.layout["superblock"] * self.blockSize, superblock)
+
+        return self.image
+
+    def directory_data(self, entries: list):
+        ''' Returns the blocks of a directory holding entries, a list of (name, inode number). '''
+
+        index, position = dirent_position(self.layout, len(entries) - 1)
+        data = bytearray((index + 1) * self.blockSize)
+
+        for entry, (name, child) in enumerate(entries):
+            index, position = dirent_position(self.layout, entry)
+            self.direntFormat.pack_into(data, index * self.blockSize + position, {"name": name.encode(), "inode": child})
+
+        return bytes(data)
+
+def build_image(tree: dict, layout: dict = None):
+    ''' Returns the disk image of a tree as a bytearray. '''
+    return ImageBuilder(disk_layout(layout)).build(tree)
+
+def write_image(tree: dict, path: str = None, layout: dict = None):
+    ''' Writes the disk image of a tree, by default as the disk image in PATH. '''
+
+    path = path if path is not None else cfg.PATH + "/" + cfg.DISK_NAME
+    image = build_image(tree, layout)
+
+    # A shell may be reading the old image.
+    with cfg.AtomicFile(path) as tmpName, open(tmpName, "wb") as imageFile:
+        imageFile.write(image)
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: records which C functions every test runs, and selects the tests affected by a change.
+Date: 18.10.26
+
+Run: "python3 main.py --coverage" to build the simulator with gcov, and
+store a map from every test to the functions of the simulator it runs.
+Run: "python3 main.py --affected" later, to run only the tests running a
+function which has changed since. A change outside functions (headers,
+globals, the Makefile...) runs all tests, as do tests not in the map.
+'''
+
+import os
+import glob
+import json
+import hashlib
+import re as regex
+import subprocess as process
+import config as cfg
+from phases import FAILING_OUTCOMES, PhaseResult
+from result_cache import config_hash, test_source
+
+# C tokens which matter for finding function definitions. Comments, strings and preprocessor lines are skipped.
+TOKEN_PATTERN = regex.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|^[ \t]*#(?:\\\n|[^\n])*'
+                              r'|[A-Za-z_]\w*|[{}();=,]', regex.S | regex.M)
+
+def digest(text: str):
+    ''' Returns a short hash of a text. '''
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def c_functions(text: str):
+    '''
+    Finds the function definitions in C source code. Returns a dictionary of
+    function name -> source text, and the text outside all functions.
+    '''
+
+    functions = {}
+    outside = ""
+    braces = parens = 0
+    declStart = last = 0
+    name = previous = None
+    function = None
+
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token[0] in "/\"'" or token.lstrip().startswith("#"):
+            continue
+
+        # A definition is a name, a parameter list and a body, outside all braces.
+        if braces == 0 and parens == 0:
+            if token == "(" and regex.match(r"[A-Za-z_]", previous or ""):
+                name = previous
+            elif token in (";", "="):
+                declStart = match.end()
+                name = None
+            elif token == "{" and previous == ")" and name is not None:
+                function = (name, declStart)
+
+        if token == "(":
+            parens += 1
+        elif token == ")":
+            parens -= 1
+        elif token == "{":
+            braces += 1
+        elif token == "}":
+            braces -= 1
+            if braces == 0:
+                if function is not None:
+                    functionName, start = function
+                    functions[functionName] = functions.get(functionName, "") + text[start:match.end()]
+                    outside += text[last:start]
+                    last = match.end()
+                    function = None
+                declStart = match.end()
+                name = None
+
+        previous = token
+
+    return functions, outside + text[last:]
+
+def source_state():
+    '''
+    Returns hashes of the simulator source: one per C function, named
+    "file:function", and one of everything else (text outside functions,
+    headers, the Makefile...).
+    '''
+
+    functions = {}
+    rest = hashlib.sha256()
+
+    for root, dirs, files in os.walk(cfg.PATH):
+        dirs.sort()
+        for name in sorted(files):
+            if name not in cfg.SOURCE_FILES and not name.endswith(cfg.SOURCE_SUFFIXES):
+                continue
+
+            filePath = os.path.join(root, name)
+            relPath = os.path.relpath(filePath, cfg.PATH)
+            with open(filePath, errors="replace") as sourceFile:
+                text = sourceFile.read()
+
+            # Only functions in C files are tracked one by one.
+            if name.endswith(".c"):
+                found, text = c_functions(text)
+                for function, body in found.items():
+                    functions["{}:{}".format(relPath, function)] = digest(body)
+
+            rest.update(relPath.encode() + b"\0" + text.encode() + b"\0")
+
+    return {"functions": functions, "rest": rest.hexdigest()[:16]}
+
+def clear_counters():
+    ''' Removes the gcov counters written by earlier runs of the simulator. '''
+
+    for dataFile in glob.glob(cfg.PATH + "/**/*.gcda", recursive=True):
+        os.remove(dataFile)
+
+def executed_functions():
+    ''' Returns the functions ("file:function") run since clear_counters(), according to gcov. '''
+
+    executed = set()
+
+    for dataFile in glob.glob(cfg.PATH + "/**/*.gcda", recursive=True):
+        result = process.run(["gcov", "--json-format", "--stdout", dataFile], cwd=cfg.PATH,
+                             stdout=process.PIPE, stderr=process.DEVNULL, universal_newlines=True)
+
+        # One JSON document per line.
+        for line in result.stdout.splitlines():
+            for fileInfo in json.loads(line)["files"]:
+                relPath = os.path.relpath(os.path.join(cfg.PATH, fileInfo["file"]), cfg.PATH)
+                executed.update("{}:{}".format(relPath, function["name"])
+                                for function in fileInfo["functions"] if function["execution_count"] > 0)
+
+    return executed
+
+def remove_build():
+    ''' Removes the instrumented program, its object files and gcov files from PATH. '''
+
+    process.run("make clean", shell=True, cwd=cfg.PATH, stdout=process.DEVNULL, stderr=process.DEVNULL)
+    for pattern in ("*.gcda", "*.gcno"):
+        for dataFile in glob.glob(cfg.PATH + "/**/" + pattern, recursive=True):
+            os.remove(dataFile)
+
+    cfg.COVERAGE_HASH = None
+
+def test_hash(test):
+    '''
+    Returns a hash of the source of the module of a test, with its module
+    level setup, and of config.py and the test helper modules (as in the
+    result cache).
+    '''
+    return digest(config_hash() + "\0" + test_source(test))
+
+class ImpactMap:
+    ''' The functions run by every test, and the source they were recorded for. '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+        try:
+            with open(path) as mapFile:
+                stored = json.load(mapFile)
+        except (OSError, ValueError):
+            stored = {"source": None, "tests": {}}
+
+        self.source = stored["source"]
+        self.tests = stored["tests"]
+
+    def record(self, test, outcome: str, functions: set):
+        ''' Stores the outcome of a test, and the functions it ran. '''
+        self.tests[test.id()] = {"hash": test_hash(test), "outcome": outcome, "functions": sorted(functions)}
+
+    def save(self):
+        ''' Stores the map, for the current source. '''
+
+        self.source = source_state()
+
+        with cfg.AtomicFile(self.path) as tmpName, open(tmpName, "w") as mapFile:
+            json.dump({"source": self.source, "tests": self.tests}, mapFile)
+
+    def changed_functions(self):
+        '''
+        Returns the functions added, removed or changed since the map was
+        stored, or None if anything else changed (or there is no map).
+        '''
+
+        current = source_state()
+        if self.source is None or current["rest"] != self.source["rest"]:
+            return None
+
+        old, new = self.source["functions"], current["functions"]
+        return {function for function in set(old) | set(new) if old.get(function) != new.get(function)}
+
+    def affected(self, tests: list):
+        ''' Returns the tests which may be affected by changes since the map was stored. '''
+
+        changed = self.changed_functions()
+        if changed is None:
+            return list(tests)
+
+        selected = []
+        for test in tests:
+            entry = self.tests.get(test.id())
+
+            # Tests not recorded, changed, failed or with no coverage data always run.
+            if (entry is None or entry["hash"] != test_hash(test) or entry["outcome"] in FAILING_OUTCOMES
+                    or not entry["functions"] or changed.intersection(entry["functions"])):
+                selected.append(test)
+
+        return selected
+
+class CoverageResult(PhaseResult):
+    ''' Test result which records the functions run by every test, in an instrumented build. '''
+
+    def startTest(self, test):
+        clear_counters()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        MAP.record(test, self.records[-1]["outcome"], executed_functions())
+
+# Map of this process.
+MAP = ImpactMap(cfg.CACHE_PATH + "/impact.json")
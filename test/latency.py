@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: optional latency log of every command sent to the shell simulator.
+Date: 18.10.26
+
+The log is off by default, then recording a command costs one attribute
+lookup. Turn it on with LOG.enable(), or "python3 main.py --latency 20".
+'''
+
+import sys
+import math
+import heapq
+import unittest
+from collections import defaultdict
+
+class LatencyLog:
+    '''
+    Latency of shell commands, from sending a command to its prompt.
+    Stored as one histogram per command type, with power of two buckets
+    in microseconds, and a list of the slowest commands.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.slowestCount = 0
+
+        # Name of the test running, shown with the slowest commands.
+        self.context = ""
+
+        self.clear()
+
+    def clear(self):
+        ''' Removes all recorded latencies. '''
+
+        # Command type -> {bucket: count}, and command type -> [count, total, max].
+        self.histograms = defaultdict(lambda: defaultdict(int))
+        self.totals = defaultdict(lambda: [0, 0.0, 0.0])
+
+        # Min-heap of (seconds, command, context) for the slowest commands.
+        self.slowest = []
+
+    def enable(self, slowestCount: int = 10):
+        ''' Starts recording, and keeps the given number of slowest commands. '''
+        self.enabled = True
+        self.slowestCount = slowestCount
+
+    def record(self, command: str, seconds: float):
+        ''' Stores the latency of one command. '''
+
+        words = command.split()
+        kind = words[0] if words else ""
+
+        # Bucket k holds latencies up to 2^k microseconds.
+        bucket = max(0, math.ceil(math.log2(max(seconds * 1e6, 1))))
+        self.histograms[kind][bucket] += 1
+
+        total = self.totals[kind]
+        total[0] += 1
+        total[1] += seconds
+        total[2] = max(total[2], seconds)
+
+        # Keep the slowest commands only.
+        entry = (seconds, command, self.context)
+        if len(self.slowest) < self.slowestCount:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def state(self):
+        ''' Returns the recorded latencies as plain data, e.g. to send from a worker process. '''
+        return ({kind: dict(buckets) for kind, buckets in self.histograms.items()},
+                dict(self.totals), list(self.slowest))
+
+    def merge(self, state):
+        ''' Adds recorded latencies from state(). '''
+
+        histograms, totals, slowest = state
+
+        for kind, buckets in histograms.items():
+            for bucket, count in buckets.items():
+                self.histograms[kind][bucket] += count
+
+        for kind, (count, seconds, maxSeconds) in totals.items():
+            total = self.totals[kind]
+            total[0] += count
+            total[1] += seconds
+            total[2] = max(total[2], maxSeconds)
+
+        for entry in slowest:
+            heapq.heappush(self.slowest, entry)
+        self.slowest = heapq.nlargest(self.slowestCount, self.slowest)
+        heapq.heapify(self.slowest)
+
+    def report(self, stream=sys.stderr):
+        ''' Prints histograms per command type, and the slowest commands. '''
+
+        stream.write("\nCommand latencies:\n")
+
+        for kind in sorted(self.totals):
+            count, seconds, maxSeconds = self.totals[kind]
+            stream.write("  {:<8} {:>7} commands, mean {:9.3f} ms, max {:9.3f} ms\n".format(
+                         kind, count, seconds / count * 1000, maxSeconds * 1000))
+
+            # One line per bucket, with a bar relative to the largest bucket.
+            buckets = self.histograms[kind]
+            largest = max(buckets.values())
+            for bucket in sorted(buckets):
+                bar = "#" * max(1, round(buckets[bucket] / largest * 40))
+                stream.write("    <= {:>10.3f} ms {:>7} {}\n".format(2 ** bucket / 1000, buckets[bucket], bar))
+
+        stream.write("\nSlowest {} commands:\n".format(len(self.slowest)))
+        for seconds, command, context in sorted(self.slowest, reverse=True):
+            stream.write("  {:9.3f} ms  {!r}  {}\n".format(seconds * 1000, command, context))
+
+class LatencyResult(unittest.TextTestResult):
+    ''' Test result which names the running test in the latency log. '''
+
+    def startTest(self, test):
+        LOG.context = test.id()
+        super().startTest(test)
+
+# Latency log of this process.
+LOG = LatencyLog()
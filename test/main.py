@@ -11,16 +11,185 @@ Supported Python version: 3.8.10
 Supported OS: Linux (Ubuntu 18.04.6 LTS)
 
 Run: "python3 main.py" to test the file system.
+Run: "python3 main.py -j 8" to run the tests in eight worker processes,
+or "-j 0" to use one worker per CPU core.
+Run: "python3 main.py --latency 20" to print the latency of every command
+type, and the 20 slowest commands.
+Run: "python3 main.py --resources" to print the CPU time, system calls and
+memory of the shell per command type and per test, see resources.py.
+Run: "python3 main.py --writes" to print the disk blocks changed by every
+command type, per region of the disk image, see block_writes.py.
+Run: "python3 main.py --junit results.xml --profile profile.json" to store
+the results, and the time used by each test phase.
+Run: "python3 main.py --fsck" to check the disk image after every test, see
+DISK_LAYOUT in config.py.
+Run: "python3 main.py --coverage" to record the C functions run by every
+test (needs gcc and gcov), and "python3 main.py --affected" later to run
+only the tests affected by changes since.
+Run: "python3 main.py --no-cache" to run tests which passed before, with
+the same source, test code and configuration, see result_cache.py.
+Run: "python3 main.py --shard 2/4" to run the second of four shards of
+about the same duration, e.g. in four CI jobs sharing one --durations
+file, see durations.py.
 '''
 
+import os
+import sys
+import atexit
+import argparse
 import unittest
+from parallel import run_parallel, flatten
+import config as cfg
+from latency import LOG
+from resources import USAGE
+from block_writes import WRITES
+from phases import TIMER, FAILING_OUTCOMES, PhaseResult, test_record, write_junit, write_profile
+from deadlines import DEADLINES
+from impact import MAP, CoverageResult, remove_build
+from result_cache import RESULTS
+from durations import DurationTable, DURATIONS, parse_shard
 
 # Import unit tests to run.
 from test_open import *
 from test_funcs import *
 from test_special import *
+from test_fuzz import *
+from test_disk import *
+
+class SelectingLoader(unittest.TestLoader):
+    ''' Test loader which leaves out tests, select is given a list of tests and returns the ones to run. '''
+
+    def __init__(self, select):
+        super().__init__()
+        self.select = select
+
+    def loadTestsFromModule(self, module, *args, **kwargs):
+        return unittest.TestSuite(self.select(flatten(super().loadTestsFromModule(module, *args, **kwargs))))
+
+    def loadTestsFromNames(self, names, module=None):
+        return unittest.TestSuite(self.select(flatten(super().loadTestsFromNames(names, module))))
 
 # Execute all imported tests.
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("--latency", type=int, default=0)
+    parser.add_argument("--resources", action="store_true")
+    parser.add_argument("--writes", action="store_true")
+    parser.add_argument("--junit")
+    parser.add_argument("--profile")
+    parser.add_argument("--fsck", action="store_true")
+    parser.add_argument("--coverage", action="store_true")
+    parser.add_argument("--affected", action="store_true")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--shard", type=parse_shard)
+    parser.add_argument("--durations")
+    args, unittestArgs = parser.parse_known_args()
+
+    # Both read the disk image.
+    if (args.fsck or args.writes) and cfg.DISK_LAYOUT is None:
+        parser.error("--fsck and --writes need DISK_LAYOUT in config.py, it is not set")
+
+    # Test durations of earlier runs, shared by all shards.
+    durations = DurationTable(args.durations) if args.durations else DURATIONS
+
+    # Check the disk image after every test.
+    cfg.FSCK = args.fsck
+
+    # Record the functions run by every test, one test at a time.
+    cfg.COVERAGE = args.coverage
+    resultClass = CoverageResult if args.coverage else PhaseResult
+
+    # Measure test phases when a report is wanted.
+    TIMER.enabled = args.junit is not None or args.profile is not None
+
+    # Record command latencies, and print them when done.
+    if args.latency > 0:
+        LOG.enable(args.latency)
+        atexit.register(LOG.report)
+
+    # Record the resources used by the shell.
+    if args.resources:
+        USAGE.enable()
+
+    # Record the disk blocks changed by every command.
+    if args.writes:
+        WRITES.enable()
+
     print("Running file system tests:\n")
-    unittest.main()
\ No newline at end of file
+
+    # Tests passed before, not run again.
+    cached = []
+    useCache = not args.no_cache and not args.coverage
+
+    def select(tests):
+        ''' Returns the tests to run. '''
+
+        if args.shard is not None:
+            # Split all tests the same way in every shard, before anything is left out.
+            count = len(tests)
+            tests = durations.shard(tests, *args.shard)
+            print("Shard {}/{}: {} of {} tests, about {:.1f} s.\n".format(args.shard[0], args.shard[1], len(tests), count,
+                  sum(durations.estimate(test.id()) for test in tests)))
+
+        if args.affected:
+            # Only tests running changed functions.
+            count = len(tests)
+            tests = MAP.affected(tests)
+            print("Running {} of {} tests, affected by changes since the last coverage run.\n".format(len(tests), count))
+
+        if useCache:
+            cached.extend(test.id() for test in tests if RESULTS.passed(test))
+            tests = [test for test in tests if test.id() not in cached]
+            if cached:
+                print("{} tests passed before with the same source, not run again (--no-cache runs them).\n".format(len(cached)))
+
+        return tests
+
+    loader = SelectingLoader(select)
+
+    if args.workers == 1 or args.coverage:
+        program = unittest.main(argv=[sys.argv[0]] + unittestArgs, exit=False, testLoader=loader,
+                                testRunner=unittest.TextTestRunner(resultclass=resultClass))
+        records = program.result.records
+        successful = program.result.wasSuccessful()
+    else:
+        workers = args.workers if args.workers > 0 else os.cpu_count()
+        # Tests named on the command line, or all, longest first, so no worker starts a slow test last.
+        names = [arg for arg in unittestArgs if not arg.startswith("-")]
+        suite = loader.loadTestsFromNames(names, sys.modules[__name__]) if names else loader.loadTestsFromModule(sys.modules[__name__])
+        tests = durations.longest_first(flatten(suite))
+        records = run_parallel(unittest.TestSuite(tests), workers)
+        successful = True
+
+    # Remember passed tests.
+    if useCache:
+        for record in records:
+            if record["outcome"] == "ok":
+                RESULTS.add(record["id"])
+        RESULTS.save()
+    records += [test_record(testId, "cached", "", 0.0, {}) for testId in cached]
+
+    # Store the test to function map, and remove the instrumented build.
+    if args.coverage:
+        MAP.save()
+        remove_build()
+
+    # Learn command deadlines and test durations for the next run. Shards keep the durations they were split by.
+    DEADLINES.save()
+    if args.shard is None:
+        durations.record(records)
+        durations.save()
+
+    # Store reports.
+    if args.resources:
+        USAGE.report(records)
+    if args.writes:
+        WRITES.report()
+    if args.junit:
+        write_junit(records, args.junit)
+    if args.profile:
+        write_profile(records, args.profile, cfg.BUILD_HASH)
+
+    successful = successful and all(record["outcome"] not in FAILING_OUTCOMES for record in records)
+    sys.exit(0 if successful else 1)
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: parses shell output into typed records, stored in hashed indexes.
+Date: 18.10.26
+'''
+
+import re as regex
+from collections import Counter
+
+# Error codes are negative numbers, not part of a name like "my-file" or "file-2".
+ERROR_PATTERN = regex.compile(r"(?<![\w-])-(\d+)")
+
+# Numbers in stat output.
+NUMBER_PATTERN = regex.compile(r"-?\d+")
+
+def parse_error(word: str):
+    ''' Returns the error code in a word, or zero if there is none. '''
+
+    error = ERROR_PATTERN.search(word)
+    if error is None:
+        return 0
+
+    return -int(error.group(1))
+
+def parse_pwd(text: str):
+    ''' Returns the path printed by pwd, or None if there is none. '''
+
+    for word in reversed(text.split()):
+        if word.startswith("/"):
+            return word
+
+    return None
+
+def parse_stat(words: list):
+    '''
+    Returns stat records as a dictionary of name -> list of numbers.
+    A record is a word ending with ":", followed by the numbers printed for it.
+    '''
+
+    records = {}
+    name = None
+
+    for word in words:
+        if word.endswith(":") and len(word) > 1:
+            # A new record.
+            name = word[:-1]
+            records[name] = []
+        elif name is not None and NUMBER_PATTERN.fullmatch(word):
+            records[name].append(int(word))
+        else:
+            # Not part of a stat record.
+            name = None
+
+    return records
+
+class OutputIndex:
+    '''
+    Index of shell output words. Built once in O(n), after which error codes,
+    words and stat records are found in constant time per lookup.
+    '''
+
+    def __init__(self, shellOutput: list):
+
+        # Multiset of all words, duplicates are counted.
+        self.words = Counter(shellOutput)
+
+        # Error codes in the order they were printed.
+        self.errors = []
+        for word in shellOutput:
+            error = parse_error(word)
+            if error != 0:
+                self.errors.append(error)
+
+        self.stats = parse_stat(shellOutput)
+
+    def first_error(self):
+        ''' Returns the first error code, or zero if there are no errors. '''
+        return self.errors[0] if self.errors else 0
+
+    def missing(self, searchNames: list):
+        '''
+        Returns the search names not found in the output. A name given
+        several times must be found at least as many times.
+        '''
+        return list((Counter(searchNames) - self.words).elements())
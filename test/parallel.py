@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: runs the file system tests in parallel worker processes.
+Date: 18.10.26
+
+Every worker gets a sandbox with a hard linked copy of the source tree,
+and uses it as PATH. The disk image is never shared, so tests in different
+workers do not see each other's files. All workers use the same cached
+program, compiled once before the workers start.
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import config as cfg
+from latency import LOG
+from resources import USAGE
+from block_writes import WRITES
+from phases import TIMER, FAILING_OUTCOMES, test_record
+from deadlines import DEADLINES
+
+def link_or_copy(source: str, destination: str):
+    ''' Hard links a file, or copies it if linking is not possible. '''
+
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def make_sandbox(basePath: str):
+    ''' Creates a sandbox copy of PATH in basePath, and returns its path. '''
+
+    sandbox = tempfile.mkdtemp(prefix="worker-", dir=basePath)
+
+    # Link everything except the disk image, which must be private.
+    shutil.copytree(cfg.PATH, sandbox + "/src", copy_function=link_or_copy,
+                    ignore=shutil.ignore_patterns(cfg.DISK_NAME))
+
+    return sandbox + "/src"
+
+def init_worker(basePath: str):
+    ''' Moves a worker process into its own sandbox. '''
+    cfg.PATH = make_sandbox(basePath)
+
+def flatten(suite):
+    ''' Returns a list of all test cases in a (nested) test suite. '''
+
+    tests = []
+
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            tests += flatten(test)
+        else:
+            tests.append(test)
+
+    return tests
+
+def run_test(testId: str):
+    '''
+    Runs one test in a worker, and returns its profile (see phases.test_record)
+    with the recorded command latencies, resources and block writes added.
+    '''
+
+    result = unittest.TestResult()
+    TIMER.reset()
+    USAGE.begin_test()
+    LOG.context = testId
+    start = time.perf_counter()
+    unittest.defaultTestLoader.loadTestsFromName(testId).run(result)
+    seconds = time.perf_counter() - start
+
+    # Tracebacks can not be sent between processes, use their text.
+    outcome, text = "ok", ""
+    if result.errors:
+        outcome, text = "error", result.errors[0][1]
+    elif result.failures:
+        outcome, text = "fail", result.failures[0][1]
+    elif result.unexpectedSuccesses:
+        outcome = "unexpected success"
+    elif result.skipped:
+        outcome, text = "skip", result.skipped[0][1]
+    elif result.expectedFailures:
+        outcome = "expected failure"
+
+    record = test_record(testId, outcome, text, seconds, TIMER.totals, dict(USAGE.test) if USAGE.enabled else None)
+
+    # Send the latencies, resources and block writes of this test only.
+    record["latencies"] = LOG.state() if LOG.enabled else None
+    record["usage"] = USAGE.state() if USAGE.enabled else None
+    record["writes"] = WRITES.state() if WRITES.enabled else None
+    record["deadlines"] = DEADLINES.drain()
+    LOG.clear()
+    USAGE.clear()
+    WRITES.clear()
+
+    return record
+
+def run_parallel(suite, workers: int, stream=sys.stderr):
+    '''
+    Runs all tests in the suite spread over the given number of worker
+    processes, and prints a summary like unittest. Returns the profile
+    of every test.
+    '''
+
+    testIds = [test.id() for test in flatten(suite)]
+    results = []
+
+    # Compile once, so no worker has to.
+    cfg.compile()
+
+    basePath = tempfile.mkdtemp(prefix="p6-parallel-")
+    start = time.perf_counter()
+
+    try:
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(basePath,)) as pool:
+            # Hand out one test at a time, so slow tests do not block a worker queue.
+            for result in pool.imap_unordered(run_test, testIds, chunksize=1):
+                results.append(result)
+                if result["latencies"] is not None:
+                    LOG.merge(result["latencies"])
+                if result["usage"] is not None:
+                    USAGE.merge(result["usage"])
+                if result["writes"] is not None:
+                    WRITES.merge(result["writes"])
+                DEADLINES.merge(result["deadlines"])
+                stream.write({"ok": ".", "fail": "F", "error": "E", "skip": "s",
+                              "expected failure": "x", "unexpected success": "u"}[result["outcome"]])
+                stream.flush()
+    finally:
+        shutil.rmtree(basePath, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    stream.write("\n")
+
+    # Print details of failing tests.
+    problems = [result for result in results if result["outcome"] in ("fail", "error")]
+    for result in problems:
+        stream.write("=" * 70 + "\n")
+        stream.write("{}: {}\n".format(result["outcome"].upper(), result["id"]))
+        stream.write("-" * 70 + "\n")
+        stream.write(result["text"] + "\n")
+
+    stream.write("-" * 70 + "\n")
+    stream.write("Ran {} tests in {:.3f}s using {} workers\n\n".format(len(results), elapsed, workers))
+
+    failures = sum(1 for result in results if result["outcome"] == "fail")
+    errors = sum(1 for result in results if result["outcome"] == "error")
+    unexpected = sum(1 for result in results if result["outcome"] == "unexpected success")
+    if any(result["outcome"] in FAILING_OUTCOMES for result in results):
+        stream.write("FAILED (failures={}, errors={}, unexpected successes={})\n".format(failures, errors, unexpected))
+    else:
+        stream.write("OK\n")
+
+    return results
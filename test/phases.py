@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: measures where test time goes, and writes JUnit XML and JSON profiles.
+Date: 18.10.26
+
+Every test is split in phases: compile (config.compile), spawn (starting a
+shell until its first prompt, and closing it), execution (waiting for shell
+output), validation (checking output) and other (the rest of the test code).
+Run: "python3 main.py --junit results.xml --profile profile.json".
+'''
+
+import json
+import time
+import xml.etree.ElementTree as xml
+from latency import LatencyResult
+from resources import USAGE
+
+PHASE_NAMES = ("compile", "spawn", "execution", "validation", "other")
+
+# Test outcomes which fail the run, as in unittest.
+FAILING_OUTCOMES = ("fail", "error", "unexpected success")
+
+class PhaseTimer:
+    '''
+    Adds up time spent in each phase. Phases may be nested, the time of an
+    inner phase is not counted in the outer phase.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.totals = dict.fromkeys(PHASE_NAMES, 0.0)
+        self.stack = []
+        self.last = 0.0
+
+    def reset(self):
+        ''' Sets all phase times to zero. '''
+        self.totals = dict.fromkeys(PHASE_NAMES, 0.0)
+        self.stack = []
+
+    def measure(self, phase: str):
+        ''' Returns a context manager measuring the time in a phase. '''
+        return Phase(self, phase)
+
+    def enter(self, phase: str):
+        now = time.perf_counter()
+
+        # Pause the outer phase.
+        if self.stack:
+            self.totals[self.stack[-1]] += now - self.last
+
+        self.stack.append(phase)
+        self.last = now
+
+    def leave(self):
+        now = time.perf_counter()
+        self.totals[self.stack.pop()] += now - self.last
+        self.last = now
+
+class Phase:
+    ''' Context manager for one phase, does nothing when timing is off. '''
+
+    def __init__(self, timer: PhaseTimer, phase: str):
+        self.timer = timer
+        self.phase = phase
+
+    def __enter__(self):
+        if self.timer.enabled:
+            self.timer.enter(self.phase)
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.timer.enabled and self.timer.stack:
+            self.timer.leave()
+
+def test_record(testId: str, outcome: str, text: str, seconds: float, phases: dict, resources: dict = None):
+    '''
+    Returns the profile of one test as a dictionary. Resources are the
+    totals of resources.py, or None when not recorded.
+    '''
+
+    phases = dict(phases)
+    phases["other"] = max(0.0, seconds - sum(phases.values()))
+
+    return {"id": testId, "outcome": outcome, "text": text, "seconds": seconds, "phases": phases,
+            "resources": resources}
+
+def write_profile(records: list, path: str, buildHash: str = None):
+    ''' Writes test profiles as JSON, with phase totals for the whole run. '''
+
+    totals = dict.fromkeys(PHASE_NAMES, 0.0)
+    for record in records:
+        for phase, seconds in record["phases"].items():
+            totals[phase] += seconds
+
+    profile = {
+        "build_hash": buildHash,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "seconds": sum(record["seconds"] for record in records),
+        "phases": totals,
+        "tests": {record["id"]: {key: record[key] for key in ("outcome", "seconds", "phases", "resources")}
+                  for record in records},
+    }
+
+    with open(path, "w") as outFile:
+        json.dump(profile, outFile, indent=2)
+
+def write_junit(records: list, path: str):
+    ''' Writes test results as JUnit XML, with phase times as test case properties. '''
+
+    suite = xml.Element("testsuite", {
+        "name": "p6-file-system",
+        "tests": str(len(records)),
+        "failures": str(sum(1 for record in records if record["outcome"] in ("fail", "unexpected success"))),
+        "errors": str(sum(1 for record in records if record["outcome"] == "error")),
+        "skipped": str(sum(1 for record in records if record["outcome"] == "skip")),
+        "time": "{:.3f}".format(sum(record["seconds"] for record in records)),
+    })
+
+    for record in records:
+        className, _, name = record["id"].rpartition(".")
+        case = xml.SubElement(suite, "testcase", {"classname": className, "name": name,
+                                                  "time": "{:.3f}".format(record["seconds"])})
+
+        properties = xml.SubElement(case, "properties")
+        for phase, seconds in record["phases"].items():
+            xml.SubElement(properties, "property", {"name": "phase." + phase, "value": "{:.6f}".format(seconds)})
+        for name, value in (record["resources"] or {}).items():
+            xml.SubElement(properties, "property", {"name": "resources." + name, "value": str(value)})
+
+        if record["outcome"] in ("fail", "error", "skip"):
+            tag = {"fail": "failure", "error": "error", "skip": "skipped"}[record["outcome"]]
+            problem = xml.SubElement(case, tag, {"message": record["text"].strip().split("\n")[-1][:200]})
+            problem.text = record["text"]
+        elif record["outcome"] == "unexpected success":
+            xml.SubElement(case, "failure", {"message": "unexpected success of a test expected to fail"})
+
+    xml.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+class PhaseResult(LatencyResult):
+    ''' Test result which stores the phase times of every test. '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records = []
+
+    def startTest(self, test):
+        TIMER.reset()
+        USAGE.begin_test()
+        self.outcome = ("ok", "")
+        self.start = time.perf_counter()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        seconds = time.perf_counter() - self.start
+        self.records.append(test_record(test.id(), self.outcome[0], self.outcome[1], seconds, TIMER.totals,
+                                        dict(USAGE.test) if USAGE.enabled else None))
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self.outcome = ("fail", self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self.outcome = ("error", self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self.outcome = ("skip", reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self.outcome = ("expected failure", self.expectedFailures[-1][1])
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self.outcome = ("unexpected success", "")
+
+# Phase timer of this process.
+TIMER = PhaseTimer()
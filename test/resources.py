@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: optional resource accounting of the shell simulator, per command and per test.
+Date: 18.10.26
+
+When on, the /proc files of a shell process are read after its first prompt
+and after every command, and the difference is given to the command: user
+and system CPU time (/proc/<pid>/stat), read and write system calls
+(/proc/<pid>/io), and resident memory with its peak (VmRSS and VmHWM in
+/proc/<pid>/status). Exit is not counted, as the process is gone when it is
+done. CPU time is counted in clock ticks, so it is only exact in sums.
+
+A memory leak shows as RSS growth: the resident memory after the last
+command of a shell, less the memory after its first prompt.
+Turn it on with USAGE.enable(), or "python3 main.py --resources".
+'''
+
+import os
+import sys
+from collections import defaultdict
+
+# Clock ticks per second, the unit of CPU time in /proc/<pid>/stat.
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+# Counters of a process before it has run, the baseline of its first prompt.
+ZERO_USAGE = {"user": 0.0, "sys": 0.0, "syscr": 0, "syscw": 0, "rss": 0, "peak_rss": 0}
+
+def process_usage(pid: int):
+    '''
+    Returns the resources used by a process so far: user and system CPU
+    seconds, read and write system calls, resident and peak resident memory
+    in kB. Returns None if the process is gone. System calls are 0 when
+    /proc/<pid>/io can not be read.
+    '''
+
+    # Imported here, deadlines imports config, which imports this module.
+    from deadlines import stat_fields
+
+    usage = dict(ZERO_USAGE)
+
+    fields = stat_fields(pid)
+    if fields is None:
+        return None
+
+    try:
+        with open("/proc/{}/status".format(pid)) as statusFile:
+            status = statusFile.read()
+    except OSError:
+        return None
+
+    # Fields 14 and 15 are user and system time.
+    usage["user"] = int(fields[11]) / CLOCK_TICKS
+    usage["sys"] = int(fields[12]) / CLOCK_TICKS
+
+    for line in status.splitlines():
+        name, _, value = line.partition(":")
+        if name == "VmRSS":
+            usage["rss"] = int(value.split()[0])
+        elif name == "VmHWM":
+            usage["peak_rss"] = int(value.split()[0])
+
+    # Not readable in some containers.
+    try:
+        with open("/proc/{}/io".format(pid)) as ioFile:
+            for line in ioFile:
+                name, _, value = line.partition(":")
+                if name in ("syscr", "syscw"):
+                    usage[name] = int(value)
+    except OSError:
+        pass
+
+    return usage
+
+def test_usage():
+    ''' Returns the resource totals of a test with no commands. '''
+    return {"commands": 0, "cpu_user": 0.0, "cpu_sys": 0.0, "syscr": 0, "syscw": 0,
+            "peak_rss_kb": 0, "rss_growth_kb": 0}
+
+class ShellUsage:
+    ''' Resources of one shell process, split over its commands. '''
+
+    def __init__(self, log, pid: int):
+        self.log = log
+        self.pid = pid
+
+        # Counters after the last command, and the resident memory after the first prompt.
+        self.last = ZERO_USAGE
+        self.startRss = None
+
+    def done(self, command: str):
+        ''' Gives the resources used since the last command to a command which is done. '''
+
+        usage = process_usage(self.pid)
+        if usage is None:
+            return
+
+        if self.startRss is None:
+            self.startRss = usage["rss"]
+
+        self.log.record(command, {name: usage[name] - self.last[name] for name in ("user", "sys", "syscr", "syscw")},
+                        usage["peak_rss"], usage["rss"] - self.startRss)
+        self.last = usage
+
+class ResourceLog:
+    '''
+    Resources used by shell commands: totals per command type, and totals
+    of the running test.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.clear()
+
+    def clear(self):
+        ''' Removes all recorded resources. '''
+
+        # Command type -> [count, user seconds, system seconds, read calls, write calls, max. peak RSS kB].
+        self.totals = defaultdict(lambda: [0, 0.0, 0.0, 0, 0, 0])
+        self.test = test_usage()
+
+    def enable(self):
+        ''' Starts recording. '''
+        self.enabled = True
+
+    def begin_test(self):
+        ''' Starts the totals of a new test. '''
+        self.test = test_usage()
+
+    def track(self, pid: int):
+        ''' Returns a ShellUsage for a new shell process, or None when recording is off. '''
+        return ShellUsage(self, pid) if self.enabled else None
+
+    def record(self, command: str, used: dict, peakRss: int, rssGrowth: int):
+        ''' Stores the resources used by one command, and the memory of its shell after it. '''
+
+        words = command.split()
+        total = self.totals[words[0] if words else ""]
+        total[0] += 1
+        total[1] += used["user"]
+        total[2] += used["sys"]
+        total[3] += used["syscr"]
+        total[4] += used["syscw"]
+        total[5] = max(total[5], peakRss)
+
+        self.test["commands"] += 1
+        self.test["cpu_user"] += used["user"]
+        self.test["cpu_sys"] += used["sys"]
+        self.test["syscr"] += used["syscr"]
+        self.test["syscw"] += used["syscw"]
+        self.test["peak_rss_kb"] = max(self.test["peak_rss_kb"], peakRss)
+        self.test["rss_growth_kb"] = max(self.test["rss_growth_kb"], rssGrowth)
+
+    def state(self):
+        ''' Returns the recorded totals per command type as plain data, e.g. to send from a worker process. '''
+        return dict(self.totals)
+
+    def merge(self, state):
+        ''' Adds recorded totals from state(). '''
+
+        for kind, (count, user, system, syscr, syscw, peakRss) in state.items():
+            total = self.totals[kind]
+            total[0] += count
+            total[1] += user
+            total[2] += system
+            total[3] += syscr
+            total[4] += syscw
+            total[5] = max(total[5], peakRss)
+
+    def report(self, records: list, stream=sys.stderr):
+        ''' Prints the totals per command type, and per test from the test records. '''
+
+        stream.write("\nShell resources per command type:\n")
+        for kind in sorted(self.totals):
+            count, user, system, syscr, syscw = self.totals[kind][:5]
+            stream.write("  {:<8} {:>7} commands, cpu {:8.3f} ms, {:8.1f} reads, {:8.1f} writes per command,"
+                         " peak rss {:>7} kB\n".format(kind, count, (user + system) / count * 1000, syscr / count,
+                                                       syscw / count, self.totals[kind][5]))
+
+        stream.write("\nShell resources per test:\n")
+        for record in records:
+            usage = record.get("resources")
+            if usage is None:
+                continue
+            stream.write("  {:<5} cpu {:8.3f} ms, {:>7} reads, {:>7} writes, peak rss {:>7} kB, rss growth {:>6} kB  {}\n"
+                         .format(record["outcome"], (usage["cpu_user"] + usage["cpu_sys"]) * 1000, usage["syscr"],
+                                 usage["syscw"], usage["peak_rss_kb"], usage["rss_growth_kb"], record["id"]))
+
+# Resource log of this process.
+USAGE = ResourceLog()
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: remembers passed tests, so they are not run again for the same source and test.
+Date: 18.10.26
+
+A test passed before is not run again when its key is the same. The key
+holds the source hash of the simulator, the source of the test module, and
+the configuration: all settings in config.py, and the test helper modules.
+The newest RESULT_CACHE_SIZE passes are kept.
+Run: "python3 main.py --no-cache" to run all tests anyway.
+'''
+
+import os
+import json
+import time
+import inspect
+import hashlib
+import config as cfg
+
+# Modules deciding test outcomes, a change to any of them runs all tests again.
+HELPER_MODULES = ("config.py", "sim_comms.py", "output_parser.py", "deadlines.py", "snapshots.py",
+                  "disk_image.py", "image_builder.py", "fuzz.py")
+
+# Settings which differ between machines, not part of the key.
+LOCAL_SETTINGS = ("PATH", "CACHE_PATH", "BINARY", "BUILD_HASH", "COVERAGE_HASH")
+
+def config_hash():
+    ''' Returns a hash of the settings in config.py, and of the test helper modules. '''
+
+    digest = hashlib.sha256()
+
+    # Settings are upper case names with plain values, e.g. not TIMER.
+    settings = {name: value for name, value in vars(cfg).items()
+                if name.isupper() and name not in LOCAL_SETTINGS
+                and isinstance(value, (str, int, float, bool, list, tuple, dict, type(None)))}
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+
+    folder = os.path.dirname(os.path.abspath(cfg.__file__))
+    for name in HELPER_MODULES:
+        try:
+            with open(os.path.join(folder, name), "rb") as moduleFile:
+                digest.update(name.encode() + b"\0" + moduleFile.read())
+        except OSError:
+            pass
+
+    return digest.hexdigest()
+
+def test_source(test):
+    '''
+    Returns the source of the module of a test, so module level setup (e.g.
+    commands of shared states) is included, or of the test method with
+    setUp and tearDown of its class if the file can not be read.
+    '''
+
+    try:
+        with open(inspect.getsourcefile(type(test)), errors="replace") as sourceFile:
+            return sourceFile.read()
+    except (OSError, TypeError):
+        pass
+
+    parts = []
+    for name in (test._testMethodName, "setUp", "tearDown"):
+        try:
+            parts.append(inspect.getsource(getattr(type(test), name)))
+        except (OSError, TypeError, AttributeError):
+            parts.append(name)
+
+    return "\0".join(parts)
+
+class ResultCache:
+    ''' Keys of passed tests, with the time each was last used. '''
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+        try:
+            with open(path) as cacheFile:
+                self.entries = json.load(cacheFile)
+        except (OSError, ValueError):
+            self.entries = {}
+
+        # Test id -> key, for tests of this run.
+        self.keys = {}
+        self.configHash = None
+
+    def key(self, test):
+        ''' Returns the cache key of a test, for the current source and configuration. '''
+
+        if self.configHash is None:
+            self.configHash = config_hash()
+        if cfg.BUILD_HASH is None:
+            cfg.BUILD_HASH = cfg.source_hash()
+
+        digest = hashlib.sha256()
+        for part in (cfg.BUILD_HASH, self.configHash, test.id(), test_source(test)):
+            digest.update(part.encode() + b"\0")
+
+        self.keys[test.id()] = digest.hexdigest()
+        return self.keys[test.id()]
+
+    def passed(self, test):
+        ''' Returns True if the test passed before, with the same key. '''
+
+        key = self.key(test)
+        if key not in self.entries:
+            return False
+
+        self.entries[key] = time.time()
+        return True
+
+    def add(self, testId: str):
+        ''' Stores a pass of a test given to passed() earlier. '''
+
+        if testId in self.keys:
+            self.entries[self.keys[testId]] = time.time()
+
+    def save(self):
+        ''' Stores the newest passes, and forgets the rest. '''
+
+        newest = sorted(self.entries.items(), key=lambda entry: entry[1], reverse=True)[:self.size]
+        self.entries = dict(newest)
+
+        with cfg.AtomicFile(self.path) as tmpName, open(tmpName, "w") as cacheFile:
+            json.dump(self.entries, cacheFile)
+
+# Result cache of this process.
+RESULTS = ResultCache(cfg.CACHE_PATH + "/results.json", cfg.RESULT_CACHE_SIZE)
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+'''
+Scaling test of the file system, via the shell program.
+
+Written by: Isak Kjerstad.
+Purpose: times operations at increasing sizes, and fails on super-linear growth.
+Date: 18.10.26
+
+Every curve times one operation against one size: entries in a directory,
+path depth or file size. The median times are fitted to a + b * n^k, and
+a curve with k above MAX_EXPONENT fails, e.g. a name lookup which is quadratic
+in the directory size. Curves growing less than MIN_GROWTH times over their
+sizes pass, as the fit of a flat curve only shows noise. A failing curve is
+measured again, up to ATTEMPTS times, and fails only if every one does. The
+best of the models in timing.py (1, n, n log n, n^2) is shown as well.
+
+The output of every setup command and timed operation is checked, a curve
+fails at once on an unexpected error code, as it would time the error path.
+
+Run: "python3 scaling.py" to run all curves, and print the fits.
+Run: "python3 scaling.py --curve ls --repeat 50 --output scaling.json".
+'''
+
+import sys
+import json
+import time
+import argparse
+import config as cfg
+from timing import best_model, growth_exponent, summarize
+from sim_comms import ShellSession, split_words, validate_output
+from deadlines import DEADLINES
+
+# Sizes measured, within the limits of the file system (200 directory entries, 256 inodes and data blocks).
+ENTRY_SIZES = (10, 25, 50, 75, 100, 125, 150, 175, 190)
+DEPTH_SIZES = (10, 25, 50, 75, 100, 125, 150, 175, 200)
+FILE_SIZES = (4096, 8192, 16384, 32768, 49152, 65536, 81920, 98304)
+
+# Largest growth exponent allowed, halfway between linear and quadratic.
+MAX_EXPONENT = 1.5
+
+# Curves growing less than this factor from the smallest to the largest size are flat, the exponent is noise.
+MIN_GROWTH = 3.0
+
+# Times a failing curve is measured, it fails only if every measurement does (a slow moment on the machine is not a failure).
+ATTEMPTS = 3
+
+class ScalingError(Exception):
+    ''' Raised when a setup command or a timed operation gives an unexpected error code. '''
+
+def check(output: str, command: str, expected: int = 0):
+    ''' Raises ScalingError if the output of a command has another error code than expected. '''
+
+    error = validate_output(split_words(output), [])
+    if error != expected:
+        raise ScalingError("{!r} gave error code {}, expected {}".format(command, error, expected))
+
+def file_lines(size: int):
+    ''' Returns lines of 32 bytes each (with newline), size bytes in total. '''
+    return ["{:031d}".format(num) for num in range(size // 32)]
+
+def make_entries(shell: ShellSession, size: int):
+    ''' Creates size empty files in root. '''
+
+    for num in range(size):
+        check(shell.write("e{}".format(num), []), "cat e{}".format(num))
+
+def make_depth(shell: ShellSession, size: int):
+    ''' Creates a directory path size levels deep. '''
+
+    for _ in range(size):
+        check(shell.run("mkdir a"), "mkdir a")
+        check(shell.run("cd a"), "cd a")
+
+    check(shell.run("cd /"), "cd /")
+
+def make_file(shell: ShellSession, size: int):
+    ''' Creates a file of size bytes. '''
+    check(shell.write_stream("big", file_lines(size))[0], "cat big")
+
+# Curve name -> (size unit, sizes, setup, timed operation returning its output, error code expected).
+CURVES = {
+    "ls": ("entries", ENTRY_SIZES, make_entries, lambda shell, size: shell.run("ls"), 0),
+    "lookup": ("entries", ENTRY_SIZES, make_entries, lambda shell, size: shell.run("stat e{}".format(size - 1)), 0),
+    "lookup_missing": ("entries", ENTRY_SIZES, make_entries, lambda shell, size: shell.run("stat missing"), -5),
+    "cd_depth": ("depth", DEPTH_SIZES, make_depth, lambda shell, size: shell.run("cd " + "/a" * size), 0),
+    "more": ("bytes", FILE_SIZES, make_file, lambda shell, size: shell.run("more big"), 0),
+    "cat": ("bytes", FILE_SIZES, make_file, lambda shell, size: shell.write_stream("big", file_lines(size))[0], 0),
+}
+
+def measure_curve(name: str, repeat: int = 20, warmup: int = 3):
+    '''
+    Times the operation of a curve at every size, each size on a new disk
+    image, and returns the result as a dictionary with the fitted growth.
+    Raises ScalingError if a command gives an unexpected error code.
+    '''
+
+    unit, sizes, setup, operation, expected = CURVES[name]
+    medians = []
+
+    for size in sizes:
+        cfg.reset_disk()
+
+        with ShellSession() as shell:
+            setup(shell, size)
+
+            latencies = []
+            for _ in range(warmup + repeat):
+                start = time.perf_counter()
+                output = operation(shell, size)
+                latencies.append(time.perf_counter() - start)
+                check(output, "{} at {} {}".format(name, size, unit), expected)
+
+        medians.append(summarize(latencies, warmup)["p50"])
+
+    model, fits = best_model(sizes, medians)
+    exponent = growth_exponent(sizes, medians)
+    growth = medians[-1] / medians[0] if medians[0] > 0 else 0.0
+
+    return {
+        "unit": unit,
+        "sizes": list(sizes),
+        "median_seconds": medians,
+        "exponent": exponent,
+        "growth": growth,
+        "model": model,
+        "fits": {fitModel: {"intercept": fit[0], "slope": fit[1], "residual": fit[2]} for fitModel, fit in fits.items()},
+        "ok": exponent <= MAX_EXPONENT or growth < MIN_GROWTH,
+    }
+
+def run_scaling(names: list, repeat: int = 20, warmup: int = 3):
+    ''' Measures the named curves, and returns the results as a dictionary. '''
+
+    cfg.compile()
+    results = {"build_hash": cfg.BUILD_HASH, "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "max_exponent": MAX_EXPONENT, "min_growth": MIN_GROWTH, "curves": {}}
+
+    try:
+        for name in names:
+            for attempt in range(1, ATTEMPTS + 1):
+                try:
+                    results["curves"][name] = measure_curve(name, repeat, warmup)
+                except ScalingError as error:
+                    # Measuring again gives the same error.
+                    results["curves"][name] = {"unit": CURVES[name][0], "sizes": list(CURVES[name][1]),
+                                               "error": str(error), "ok": False, "attempts": attempt}
+                    break
+
+                results["curves"][name]["attempts"] = attempt
+                if results["curves"][name]["ok"]:
+                    break
+    finally:
+        cfg.cleanup()
+        DEADLINES.save()
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="File system scaling test.")
+    parser.add_argument("--curve", action="append", choices=sorted(CURVES),
+                        help="curve to measure, may be given several times (default: all)")
+    parser.add_argument("--repeat", type=int, default=20, help="timed operations per size")
+    parser.add_argument("--warmup", type=int, default=3, help="operations per size before timing")
+    parser.add_argument("--output", help="JSON file to write")
+    args = parser.parse_args()
+
+    results = run_scaling(args.curve or list(CURVES), args.repeat, args.warmup)
+
+    for name, curve in results["curves"].items():
+        if "error" in curve:
+            print("{:<15} FAIL {}".format(name, curve["error"]))
+            continue
+
+        times = " ".join("{:.3f}".format(seconds * 1000) for seconds in curve["median_seconds"])
+        print("{:<15} {:<4} n^{:.2f} ({}, x{:.1f}): {} ms at {} {}".format(name, "ok" if curve["ok"] else "FAIL",
+              curve["exponent"], curve["model"], curve["growth"], times, curve["unit"], list(curve["sizes"])))
+
+    if args.output:
+        with open(args.output, "w") as outFile:
+            json.dump(results, outFile, indent=2)
+
+    sys.exit(0 if all(curve["ok"] for curve in results["curves"].values()) else 1)
@@ -6,20 +6,138 @@ Purpose: functions handeling simulator communication and output validation.
 Date: 24.05.22
 '''
 
+import os
 import re as regex
+import time
+import select
+import signal
+import hashlib
 import config as cfg
 import pexpect as process
+from collections import Counter
+from output_parser import OutputIndex, parse_error
+from latency import LOG
+from resources import USAGE
+from block_writes import WRITES
+from phases import TIMER
+from deadlines import DEADLINES, ShellHung, process_state
 
-def cat_write(filename: str, strLines: list):
+# Seconds between checks of a shell waiting for output.
+POLL_TIME = 0.05
 
-    # Create input to cat consisting of text, and commands to close cat. Specified file name is also set.
-    catInput = "cat " + "{}".format(filename) + "\n" + construct_multi_command(strLines) + "\n" + "." + "\n"
+# Bytes of cat input sent at a time by write_stream().
+CHUNK_SIZE = 4096
 
-    # Run cat commands in shell.
-    output = run_commands([catInput])
+# Longest line the terminal passes on, in bytes with the newline.
+MAX_LINE = 4095
+
+def cat_write(filename: str, strLines):
+    '''
+    Stores lines in a file with cat, in a new shell, and returns the shell
+    error code. Lines may be any iterable, e.g. a generator or a file object.
+    '''
+
+    # Stream the text to cat, and close the shell.
+    with ShellSession() as myShell:
+        output = myShell.banner + myShell.write_stream(filename, strLines)[0]
+        output += myShell.close()
 
     # Return shell error codes.
-    return validate_output(output, [])
+    return validate_output(split_words(output), [])
+
+def verify_file(filename: str, strLines):
+    '''
+    Reads a file with more, in a new shell, and compares it with the lines
+    stored by cat_write, in one pass and constant memory. Lines may be any
+    iterable, as for cat_write. Returns a dictionary (see compare_streams)
+    with the offset of the first differing byte, None if the file is as
+    written.
+    '''
+
+    with ShellSession() as myShell:
+        result = compare_streams(chunk_lines(strLines), myShell.read_stream(filename))
+
+    return result
+
+def first_difference(expected: bytes, actual: bytes):
+    ''' Returns the index of the first differing byte, or the length of the shorter one if one starts the other. '''
+
+    for index, (expectedByte, actualByte) in enumerate(zip(expected, actual)):
+        if expectedByte != actualByte:
+            return index
+
+    return min(len(expected), len(actual))
+
+def compare_streams(expected, actual):
+    '''
+    Compares two iterables of bytes chunks, of any sizes, in one pass. Both
+    are hashed with BLAKE2 meanwhile. Returns a dictionary with the offset
+    of the first differing byte (None if equal), and the size and digest
+    of each.
+    '''
+
+    expectedDigest, actualDigest = hashlib.blake2b(), hashlib.blake2b()
+    expectedSize = actualSize = 0
+    expected = iter(expected)
+    offset = None
+
+    # Expected bytes read ahead, not yet compared from position on.
+    pending, position = b"", 0
+
+    for chunk in actual:
+        actualDigest.update(chunk)
+
+        if offset is None:
+            # Read expected bytes until there are as many as in the chunk.
+            while len(pending) - position < len(chunk):
+                more = next(expected, None)
+                if more is None:
+                    break
+                expectedDigest.update(more)
+                expectedSize += len(more)
+                pending, position = pending[position:] + more, 0
+
+            part = pending[position:position + len(chunk)]
+            if part != chunk:
+                offset = actualSize + first_difference(part, chunk)
+            position += len(chunk)
+
+        actualSize += len(chunk)
+
+    # Hash the rest, the digests cover all of both.
+    for more in expected:
+        expectedDigest.update(more)
+        expectedSize += len(more)
+
+    if offset is None and expectedSize != actualSize:
+        offset = actualSize
+
+    return {"offset": offset, "expected_size": expectedSize, "size": actualSize,
+            "expected_digest": expectedDigest.hexdigest(), "digest": actualDigest.hexdigest()}
+
+def chunk_lines(strLines, chunkSize: int = CHUNK_SIZE):
+    '''
+    Yields lines as encoded chunks of about chunkSize bytes, each ending
+    with a whole line. Lines may be str or bytes, with or without a newline.
+    '''
+
+    chunk = bytearray()
+
+    for line in strLines:
+        line = line.encode("utf-8") if isinstance(line, str) else bytes(line)
+        line = (line[:-1] if line.endswith(b"\n") else line) + b"\n"
+
+        # A single "." ends cat, and longer lines are cut by the terminal.
+        if line == b".\n" or len(line) > MAX_LINE:
+            raise ValueError("cat can not store the line {!r}".format(line[:40]))
+
+        chunk += line
+        if len(chunk) >= chunkSize:
+            yield bytes(chunk)
+            chunk = bytearray()
+
+    if chunk:
+        yield bytes(chunk)
 
 def construct_multi_command(commands: list):
     ''' Returns a string consisting of multiple commands. '''
@@ -27,46 +145,524 @@ def construct_multi_command(commands: list):
     # Add newlines between commands.
     return "\n".join(commands)
 
+class ShellSession:
+    '''
+    One running shell simulator. Commands are sent one at a time, and the
+    output of each command is read up to the next prompt. This way one
+    process can run any number of commands. Use in a "with" statement, or
+    call open() and close().
+
+    Every command has a deadline (see deadlines.py). A shell that misses it,
+    or waits for input without printing a prompt, is killed at once and
+    ShellHung is raised. Streamed reads and writes of files move any number
+    of bytes, so they wait up to the timeout for each line instead, and are
+    not learned from.
+    '''
+
+    def __init__(self, timeout: int = cfg.TIMEOUT):
+        self.timeout = timeout
+        self.shell = None
+
+        # Shell output before the first prompt.
+        self.banner = ""
+
+        # Commands sent by feed(), not yet known to be done.
+        self.fed = []
+
+        # Resources used by the shell process, and blocks written to its disk image, when recorded.
+        self.usage = None
+        self.writes = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        elif self.shell is not None:
+            # Do not wait for a shell that may be hung.
+            self.finish(kill=True)
+
+    def open(self):
+        ''' Starts the shell simulator, and waits for the first prompt. '''
+
+        with TIMER.measure("spawn"):
+            # Open the compiled shell simulator in PATH with UTF-8 mode, and mute the terminal output.
+            self.shell = process.spawn(cfg.BINARY, cwd=cfg.PATH, encoding="utf-8", echo=False, timeout=self.timeout)
+
+            # Do not sleep before every send, it would hide the time used by the shell.
+            self.shell.delaybeforesend = None
+
+            start = time.monotonic()
+            self.usage = USAGE.track(self.shell.pid)
+            self.writes = WRITES.track(cfg.PATH + "/" + cfg.DISK_NAME)
+            self.expect(cfg.PROMPT, "<start>", start + self.budget("<start>"), "spawn")
+            DEADLINES.observe("<start>", time.monotonic() - start)
+            self.banner = self.shell.before
+
+            if self.usage is not None:
+                self.usage.done("<start>")
+            if self.writes is not None:
+                self.writes.done("<start>")
+
+    def budget(self, command: str):
+        ''' Returns the time in seconds a command may use. '''
+        return min(self.timeout, DEADLINES.budget(command))
+
+    def expect(self, pattern, command: str, deadline: float, phase: str = "execution"):
+        '''
+        Waits for a pattern in the shell output, and returns its index. The
+        shell is killed if the deadline (time.monotonic) is passed, or if it
+        is stalled. Command is the command waited for, used in errors, and
+        phase the test phase the wait is counted in (see phases.py).
+        '''
+
+        with TIMER.measure(phase):
+            begin = lastProgress = time.monotonic()
+            lastState = process_state(self.shell.pid)
+            lastSize = len(self.shell.buffer)
+
+            while True:
+                try:
+                    return self.shell.expect(pattern, timeout=min(POLL_TIME, cfg.STALL_TIME))
+                except process.TIMEOUT:
+                    pass
+
+                now = time.monotonic()
+                state = process_state(self.shell.pid)
+
+                # Output, CPU time used or a running process is progress.
+                if len(self.shell.buffer) != lastSize or state != lastState or state[0] not in ("S", "T", "t"):
+                    lastProgress = now
+                    lastState = state
+                    lastSize = len(self.shell.buffer)
+
+                # Before the first prompt the shell may still be starting, e.g. under a wrapper, only the deadline applies.
+                if now - lastProgress > cfg.STALL_TIME and command != "<start>":
+                    self.finish(kill=True)
+                    raise ShellHung(command, "waiting for input with no prompt for {:.2f} s".format(now - lastProgress))
+
+                if now > deadline:
+                    self.finish(kill=True)
+                    raise ShellHung(command, "not done within its deadline of {:.2f} s".format(deadline - begin))
+
+    def run(self, command: str):
+        '''
+        Runs one command, or several separated by newlines, and returns the
+        output as text. A "cat" line stores the lines after it in the file,
+        until a line with a single ".".
+        '''
+
+        output = ""
+
+        for line, strLines in split_script(command):
+            # Lines for cat are stored in the file.
+            if strLines is not None:
+                output += self.write(line[4:], strLines)
+                continue
+
+            # Run one command, and read until it is done.
+            start = time.monotonic()
+            self.shell.send(line + "\n")
+            self.expect(cfg.PROMPT, line, start + self.budget(line))
+            output += self.shell.before
+            self.done(line, start)
+
+        return output
+
+    def write(self, filename: str, strLines: list):
+        ''' Stores the lines in a file with cat, and returns the output as text. '''
+        return self.write_stream(filename, strLines)[0]
+
+    def write_stream(self, filename: str, strLines, chunkSize: int = CHUNK_SIZE):
+        '''
+        Stores lines in a file with cat, sent in chunks as fast as the shell
+        reads them, so files of any size can be written. Lines may be any
+        iterable, e.g. a generator or a file object. Returns the output as
+        text, the bytes of text sent, and the seconds used.
+        '''
+
+        command = "cat " + filename
+        start = time.monotonic()
+        self.shell.send(command + "\n")
+
+        byteCount = 0
+        failed = False
+
+        for chunk in chunk_lines(strLines, chunkSize):
+            # Stop sending if cat has failed, i.e. a prompt is shown.
+            failed = self.send_all(chunk, command)
+            byteCount += len(chunk)
+            if failed:
+                break
+
+        if not failed:
+            # The shell may store all the lines when cat ends, the time grows with the bytes sent.
+            self.shell.send(".\n")
+            self.expect(cfg.PROMPT, command, time.monotonic() + self.timeout)
+
+        output = self.shell.before
+
+        if not failed and validate_output(split_words(output), []) == 0:
+            seconds = time.monotonic() - start
+            self.done(command, start, learn=False)
+            return output, byteCount, seconds
+
+        # If cat failed early, the lines sent were run as commands with one prompt each. Read until quiet.
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline and self.shell.expect([cfg.PROMPT, process.TIMEOUT], timeout=cfg.STALL_TIME) == 0:
+            output += self.shell.before
+
+        return output, byteCount, time.monotonic() - start
+
+    def send_all(self, data: bytes, command: str):
+        '''
+        Sends data without blocking, as fast as the shell reads it. Returns
+        True if the shell showed a prompt meanwhile. The shell is killed if
+        it stops reading for TIMEOUT seconds, or is stalled.
+        '''
+
+        fd = self.shell.child_fd
+        os.set_blocking(fd, False)
+
+        try:
+            with TIMER.measure("execution"):
+                lastSent = lastProgress = time.monotonic()
+                lastState = process_state(self.shell.pid)
+                prompted = False
+
+                while data:
+                    readable, writable, _ = select.select([fd], [fd], [], POLL_TIME)
+
+                    # Read output, so the shell never waits for us.
+                    if readable and not prompted and self.shell.expect([cfg.PROMPT, process.TIMEOUT], timeout=0) == 0:
+                        prompted = True
+
+                    if writable:
+                        try:
+                            sent = os.write(fd, data)
+                        except BlockingIOError:
+                            sent = 0
+                        data = data[sent:]
+                        if sent:
+                            lastSent = lastProgress = time.monotonic()
+                            continue
+
+                    # CPU time used or a running process is progress, as in expect().
+                    now = time.monotonic()
+                    state = process_state(self.shell.pid)
+                    if state != lastState or state[0] not in ("S", "T", "t", None):
+                        lastProgress = now
+                        lastState = state
+
+                    if now - lastProgress > cfg.STALL_TIME or now - lastSent > self.timeout:
+                        self.finish(kill=True)
+                        raise ShellHung(command, "not reading input for {:.2f} s".format(now - lastSent))
+
+                return prompted
+        finally:
+            if self.shell is not None:
+                os.set_blocking(fd, True)
+
+    def done(self, command: str, start: float, learn: bool = True):
+        '''
+        Stores the time, resources and disk blocks used by a command which is
+        done. The time is not learned for deadlines if learn is False, e.g.
+        for streamed reads and writes.
+        '''
+
+        seconds = time.monotonic() - start
+        if learn:
+            DEADLINES.observe(command, seconds)
+
+        if LOG.enabled:
+            LOG.record(command, seconds)
+
+        if self.usage is not None:
+            self.usage.done(command)
+        if self.writes is not None:
+            self.writes.done(command)
+
+    def read_stream(self, filename: str):
+        '''
+        Reads a file with more, and yields the output as encoded chunks of
+        one line each, as they arrive, so it is never kept in memory. Lines
+        end with a newline, without the carriage return added by the
+        terminal. Stops at the next prompt. Every line may take up to the
+        timeout, the file may be of any size.
+        '''
+
+        command = "more " + filename
+        start = time.monotonic()
+        self.shell.send(command + "\n")
+
+        while self.expect([cfg.PROMPT, "\r\n"], command, time.monotonic() + self.timeout) == 1:
+            yield (self.shell.before + "\n").encode("utf-8")
+
+        # Output in front of the prompt, i.e. a last line with no newline.
+        if self.shell.before:
+            yield self.shell.before.encode("utf-8")
+
+        self.done(command, start, learn=False)
+
+    def feed(self, text: str):
+        '''
+        Sends raw input to the shell, without waiting for any prompt. The
+        commands are waited for by close() or stream_exit(), see read_fed().
+        '''
+
+        self.shell.send(text)
+        self.fed += [line for line, strLines in split_script(text)]
+
+    def stream(self, command: str):
+        '''
+        Runs one command, and yields the output words as they arrive. Output
+        is read one line at a time, so it is never kept in memory. Stops at
+        the next prompt.
+        '''
+
+        start = time.monotonic()
+        self.shell.send(command + "\n")
+        yield from self.stream_until(cfg.PROMPT, command, start + self.budget(command))
+        self.done(command, start)
+
+    def read_fed(self):
+        '''
+        Yields the output of the commands sent by feed() as text, a line or
+        a prompt at a time, until they are all done. Each command has its own
+        deadline from the prompt in front of it, so a hung shell is found
+        after the deadline of the command it hangs on, which is named.
+        '''
+
+        while self.fed:
+            command = self.fed[0]
+            deadline = time.monotonic() + self.budget(command)
+
+            index = self.expect([cfg.PROMPT, "\n", process.EOF], command, deadline)
+            while index == 1:
+                yield self.shell.before + "\n"
+                index = self.expect([cfg.PROMPT, "\n", process.EOF], command, deadline)
+
+            # The shell has exited, e.g. crashed, the output so far is all there is.
+            if index == 2:
+                self.fed = []
+                yield self.shell.before
+                return
+
+            # The prompt is kept, so the words are split as without it.
+            yield self.shell.before + self.shell.after
+            self.fed.pop(0)
+
+    def stream_exit(self):
+        ''' Exits the shell, and yields the output words not yet read. '''
+
+        for text in self.read_fed():
+            yield from split_words(text)
+
+        # Waiting for exit is spawn time.
+        if not self.shell.flag_eof:
+            deadline = time.monotonic() + self.budget("exit")
+            self.shell.send("exit\n")
+            yield from self.stream_until(process.EOF, "exit", deadline, "spawn")
+        self.finish()
+
+    def stream_until(self, end, command: str, deadline: float, phase: str = "execution"):
+        ''' Yields output words one line at a time, until the end pattern is found. '''
+
+        # Tokenise every complete line.
+        while self.expect([end, "\n"], command, deadline, phase) == 1:
+            yield from split_words(self.shell.before)
+
+        # Output in front of the end pattern.
+        yield from split_words(self.shell.before)
+
+    def close(self):
+        ''' Exits the shell, and returns the output not yet read as text. '''
+
+        if self.shell is None:
+            return ""
+
+        # Wait for fed commands, then exit and read the remaining output. Waiting for exit is spawn time.
+        output = "".join(self.read_fed())
+        if not self.shell.flag_eof:
+            deadline = time.monotonic() + self.budget("exit")
+            self.shell.send("exit\n")
+            self.expect(process.EOF, "exit", deadline, "spawn")
+            output += self.shell.before
+        self.finish()
+
+        return output
+
+    def finish(self, kill: bool = False):
+        '''
+        Waits for the shell process to end, or kills it, and closes it.
+        Pexpect's fixed sleeps when closing are not used.
+        '''
+
+        with TIMER.measure("spawn"):
+            self.shell.ptyproc.delayafterclose = 0
+
+            if kill:
+                self.shell.kill(signal.SIGKILL)
+
+            # The shell has exited, or is killed, wait for it to end.
+            end = time.monotonic() + cfg.STALL_TIME
+            while self.shell.isalive() and time.monotonic() < end:
+                time.sleep(0.001)
+
+            self.shell.close(force=True)
+            self.shell = None
+
+def split_words(text: str):
+    ''' Returns the words in shell output, without prompts. '''
+
+    words = []
+
+    for word in text.split():
+        # Do not add "$", i.e. empty outputs.
+        if regex.search("\$", word) is None:
+            words.append(word)
+
+    return words
+
+def split_script(text: str):
+    '''
+    Splits shell input into a list of (command, cat lines) pairs. Cat lines
+    are the lines stored by a "cat" command, and None for other commands.
+    Empty command lines are left out.
+    '''
+
+    script = []
+    lines = text.split("\n")
+    num = 0
+
+    while num < len(lines):
+        line = lines[num]
+        num += 1
+
+        if line.split()[:1] == ["cat"]:
+            # Cat reads lines until a single ".".
+            strLines = []
+            while num < len(lines) and lines[num] != ".":
+                strLines.append(lines[num])
+                num += 1
+            num += 1
+            script.append((line, strLines))
+        elif line.strip():
+            script.append((line, None))
+
+    return script
+
+def stream_commands(commands: list):
+    '''
+    Runs commands like run_commands, and yields the output words as they
+    arrive. Closing the generator early stops the running shell.
+    '''
+
+    # Exec. all commands.
+    for command in commands:
+
+        with ShellSession() as myShell:
+            yield from split_words(myShell.banner)
+
+            # Run one command.
+            script = command + "\n"
+
+            # Save cat file.
+            if "cat" in command:
+                # Store fname in file, and save.
+                script += command[4:] + "\n.\n"
+
+            if LOG.enabled or USAGE.enabled or WRITES.enabled:
+                # Wait for the prompt after each line, to time every command.
+                yield from split_words(myShell.run(script))
+            else:
+                myShell.feed(script)
+
+            # Exit, i.e. get stdout result.
+            yield from myShell.stream_exit()
+
 def run_commands(commands: list):
     '''
     Runs commands in list, and returns a list of outputs from the shell
     as separate words. If command "cat" is utilized the given file name is
-    stored in the file, before it is eventually saved and closed.
+    stored in the file, before it is eventually saved and closed. Each
+    element is run in a new shell, use ShellSession to run many commands
+    in one shell.
     '''
 
     # List of shell stdout and stderr's as words.
-    shellOutput = []
+    return list(stream_commands(commands))
 
-    # Exec. all commands.
-    for command in commands:
+def check_commands(commands: list, searchNames: list, forbiddenNames: list = None):
+    '''
+    Runs commands like run_commands and checks the output while it arrives.
+    Gives the same result as validate_output, but stops the shell at the
+    first error code. Returns -1 as soon as a forbidden name is found.
+    '''
 
-        # Open the shell simulator in PATH with EXEC_NAME in UTF-8 mode, and mute the terminal output.
-        myShell = process.spawn(cfg.PATH + "/" + cfg.EXEC_NAME, cwd=cfg.PATH, encoding="utf-8", echo=False, timeout=cfg.TIMEOUT)
+    with TIMER.measure("validation"):
+        remaining = Counter(searchNames)
+        forbidden = set(forbiddenNames or [])
+        words = stream_commands(commands)
 
-        # Run one command.
-        myShell.send(command + "\n")
+        for word in words:
+            error = parse_error(word)
 
-        # Save cat file.
-        if "cat" in command:
-            # Store fname in file, and save.
-            myShell.send(command[4:] + "\n.\n")
+            # Stop at the first error, or unexpected name.
+            if error != 0 or word in forbidden:
+                words.close()
+                return error if error != 0 else -1
 
-        # Exit, i.e. get stdout result.
-        myShell.send("exit\n")
+            if remaining[word] > 0:
+                remaining[word] -= 1
 
-        # Search entire shell output.
-        for line in myShell.readlines():
-            # Add results to the output.
-            for word in line.split():
-                # Do not add "$", i.e. empty outputs.
-                if regex.search("\$", word) is None:
-                    shellOutput.append(word)
+        # Verify that all search names exist.
+        if +remaining:
+            return -1
+
+        # No errors.
+        return 0
 
-    return shellOutput
+def run_batch(commands: list):
+    '''
+    Runs the commands in list like run_commands, but all of them in one shell.
+    Returns one list of output words per element in commands, so every
+    output is attributed to the command that made it. The shell is moved back
+    to the root directory between elements, as if it was a new shell.
+
+    The prompt printed after each command line is used as the separator between
+    outputs. The shell has no command to print a marker, and a marker file would
+    change the file system under test.
+    '''
+
+    outputs = []
+
+    with ShellSession() as myShell:
+
+        for num, command in enumerate(commands):
+            # Start from root, as a new shell.
+            if num > 0:
+                myShell.run("cd /")
+
+            # Same input as run_commands, with the file name stored by cat.
+            script = command + "\n"
+            if "cat" in command:
+                script += command[4:] + "\n.\n"
+
+            outputs.append(split_words(myShell.run(script)))
+
+        # Output from starting the shell belongs to the first command.
+        if outputs:
+            outputs[0] = split_words(myShell.banner) + outputs[0]
+
+    return outputs
 
 def validate_output(shellOutput: list, searchNames: list):
     '''
-    Check shell output for any error codes. Validate existence of search names. 
+    Check shell output for any error codes. Validate existence of search names,
+    a name given several times must be found as many times.
     Returns an error code, or zero if no errors.
 
     Error codes:
@@ -97,20 +693,18 @@ def validate_output(shellOutput: list, searchNames: list):
     -23     ->  tried to delete a file that is open by another program.
     '''
 
-    # Search entire shell output.
-    for word in shellOutput:
+    with TIMER.measure("validation"):
+        # Index the entire shell output once.
+        index = OutputIndex(shellOutput)
 
-        # Search for errors, e.g. negative numbers.
-        error = regex.search("-(\d*)", word)
-        if error is not None:
-            # Return file system error code.
-            return int(error.group(error.pos))
+        # Return the first file system error code, e.g. negative numbers.
+        if index.first_error() != 0:
+            return index.first_error()
 
-    # If no errors, verify that all search names exist.
-    for query in searchNames:
-        if query not in shellOutput:
+        # If no errors, verify that all search names exist.
+        if index.missing(searchNames):
             # Entry not found.
             return -1
-    
-    # No errors.
-    return 0
\ No newline at end of file
+
+        # No errors.
+        return 0
\ No newline at end of file
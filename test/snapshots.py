@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: saves and restores disk images of file system states that are slow to build.
+Date: 18.10.26
+'''
+
+import os
+import fcntl
+import shutil
+import hashlib
+import config as cfg
+from sim_comms import run_commands, validate_output
+
+# Linux ioctl for sharing the data blocks of two files (copy-on-write).
+FICLONE = 0x40049409
+
+def copy_image(source: str, destination: str):
+    ''' Copies a disk image, as a reflink if the file system supports it. '''
+
+    with cfg.AtomicFile(destination) as tmpName:
+        try:
+            with open(source, "rb") as sourceFile, open(tmpName, "wb") as destFile:
+                fcntl.ioctl(destFile.fileno(), FICLONE, sourceFile.fileno())
+        except OSError:
+            # No reflink support, let the kernel copy the file.
+            shutil.copyfile(source, tmpName)
+
+def state_path(name: str, commands: list):
+    ''' Returns the snapshot path of a state, for the current build. '''
+
+    if cfg.BUILD_HASH is None:
+        cfg.BUILD_HASH = cfg.source_hash()
+
+    # Changing the commands of a state gives a new snapshot.
+    commandHash = hashlib.sha256("\0".join(commands).encode()).hexdigest()[:16]
+
+    return "{}/{}/states/{}-{}".format(cfg.CACHE_PATH, cfg.BUILD_HASH, name, commandHash)
+
+def use_state(name: str, commands: list):
+    '''
+    Puts the disk image of a named state in PATH. The first time, the state is
+    made by running the commands (with run_commands) on the current disk image,
+    normally a new one, and saved for the current build. Later the image is
+    only copied. Parallel workers build a state one at a time. Returns an
+    error code, zero if no errors.
+    '''
+
+    snapshot = state_path(name, commands)
+    disk = cfg.PATH + "/" + cfg.DISK_NAME
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+
+    # One process builds a state at a time, so others wait and restore it.
+    with open(snapshot + ".lock", "w") as lockFile:
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+
+        # Restore a saved state.
+        if os.path.exists(snapshot):
+            copy_image(snapshot, disk)
+            return 0
+
+        # Build the state, only keep it if there were no errors.
+        error = validate_output(run_commands(commands), [])
+        if error == 0:
+            copy_image(disk, snapshot)
+
+    return error
@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+
+'''
+Soak test of the file system, via the shell program.
+
+Written by: Isak Kjerstad.
+Purpose: runs create, write and delete churn in one shell for a long time, and flags slowdowns and leaks.
+Date: 18.10.26
+
+The churn fills the disk up to HIGH_WATER files, empties it down to
+LOW_WATER, and repeats, so bitmaps and directories are used at every fill
+level, and get fragmented over time. Every window of operations gets its
+throughput and latency percentiles, and the inodes and data blocks in use
+according to the bitmaps of the disk image. The run fails on:
+
+- an error code from a command which should work,
+- more inodes or data blocks in use than the files need (a leak),
+- a median latency of a command type in the last windows more than
+  MAX_SLOWDOWN times its median latency in the first windows. Command
+  types are compared one by one, as the mix of commands changes between
+  filling and emptying the disk.
+
+The accounting needs DISK_LAYOUT in config.py, the soak test does not run
+without it.
+
+Run: "python3 soak.py --operations 1000000" to run a million operations.
+Run: "python3 soak.py --seconds 3600 --output soak.json" to run for an hour.
+'''
+
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import config as cfg
+from timing import summarize
+from sim_comms import ShellSession, split_words, validate_output
+from disk_image import DiskImage, RecordFormat, check_disk, dirent_position, disk_layout
+from deadlines import DEADLINES
+
+# Directories the files are spread over, each holds at most HIGH_WATER / DIRECTORIES files.
+DIRECTORIES = 4
+
+# Files when the churn turns from filling to emptying the disk, and back.
+HIGH_WATER = 160
+LOW_WATER = 20
+
+# Most data blocks used by files, below the size of the disk.
+BLOCK_BUDGET = 200
+
+# Most lines of 32 bytes in a file.
+MAX_LINES = 40
+
+# Windows at the start and end compared to find a slowdown, the first window is left out (cold caches).
+BASE_WINDOWS = 3
+
+# Largest median latency of a command type in the last windows allowed, relative to the first windows.
+MAX_SLOWDOWN = 2.0
+
+# Commands of a type needed in every compared window to compare its latency.
+MIN_COMMANDS = 20
+
+class SoakError(Exception):
+    ''' Raised when a command gives an error code. '''
+
+class Churn:
+    ''' The files made by the soak test, and the commands changing them. '''
+
+    def __init__(self, shell: ShellSession, seed: int):
+        self.shell = shell
+        self.rng = random.Random(seed)
+        self.layout = disk_layout()
+        self.directs = RecordFormat(self.layout["inode_fields"]).count("direct")
+
+        # File name -> (directory, size in bytes), and the most entries each directory has had.
+        self.files = {}
+        self.mostEntries = [2] * DIRECTORIES
+        self.cwd = None
+        self.count = 0
+        self.filling = True
+
+        # Latencies of the window running, per command type.
+        self.latencies = []
+        self.kinds = {}
+
+    def run(self, command: str, strLines: list = None):
+        ''' Runs one command (cat if lines are given), and raises SoakError on an error code. '''
+
+        start = time.perf_counter()
+        if strLines is None:
+            output = self.shell.run(command)
+        else:
+            output = self.shell.write(command[4:], strLines)
+        seconds = time.perf_counter() - start
+
+        self.latencies.append(seconds)
+        self.kinds.setdefault(command.split()[0], []).append(seconds)
+        self.count += 1
+
+        if validate_output(split_words(output), []) != 0:
+            raise SoakError("command {} ({!r}) gave {!r} with {} files".format(
+                            self.count, command, output.strip()[:200], len(self.files)))
+
+    def setup(self):
+        ''' Makes the directories. '''
+
+        for num in range(DIRECTORIES):
+            self.run("mkdir d{}".format(num))
+
+    def enter(self, directory: int):
+        ''' Moves the shell to a directory, if not there. '''
+
+        if self.cwd != directory:
+            self.run("cd /d{}".format(directory))
+            self.cwd = directory
+
+    def file_blocks(self, size: int):
+        ''' Returns the data blocks used by a file of size bytes, with the indirect block. '''
+
+        blocks = -(-size // self.layout["block_size"])
+        return blocks + (1 if blocks > self.directs else 0)
+
+    def blocks_used(self):
+        ''' Returns the data blocks used by all files. '''
+        return sum(self.file_blocks(size) for directory, size in self.files.values())
+
+    def write(self, name: str, directory: int):
+        ''' Writes a random number of lines to a file, new or not. '''
+
+        lineCount = self.rng.randrange(MAX_LINES + 1)
+        oldSize = self.files[name][1] if name in self.files else 0
+
+        # Keep the files within the block budget.
+        if self.blocks_used() - self.file_blocks(oldSize) + self.file_blocks(lineCount * 32) > BLOCK_BUDGET:
+            lineCount = 0
+
+        self.enter(directory)
+        self.run("cat " + name, ["{}_{:026d}".format(name[:4], num) for num in range(lineCount)])
+        self.files[name] = (directory, lineCount * 32)
+
+        entries = 2 + sum(1 for fileDir, size in self.files.values() if fileDir == directory)
+        self.mostEntries[directory] = max(self.mostEntries[directory], entries)
+
+    def step(self):
+        ''' Runs one random operation. '''
+
+        if len(self.files) >= HIGH_WATER:
+            self.filling = False
+        elif len(self.files) <= LOW_WATER:
+            self.filling = True
+
+        # Filling creates more than it removes, emptying the other way around.
+        weights = [50, 20, 10, 10, 5, 5] if self.filling else [10, 20, 50, 10, 5, 5]
+        operation = self.rng.choices(["create", "overwrite", "remove", "read", "stat", "ls"], weights)[0]
+
+        if operation == "create" or not self.files:
+            directory = self.rng.randrange(DIRECTORIES)
+            if sum(1 for fileDir, size in self.files.values() if fileDir == directory) < HIGH_WATER // DIRECTORIES:
+                self.write("f{}".format(self.count), directory)
+            return
+
+        name = self.rng.choice(sorted(self.files))
+        directory = self.files[name][0]
+        self.enter(directory)
+
+        if operation == "overwrite":
+            self.write(name, directory)
+        elif operation == "remove":
+            self.run("rm " + name)
+            del self.files[name]
+        elif operation == "read":
+            self.run("more " + name)
+        else:
+            self.run("stat " + name if operation == "stat" else "ls")
+
+    def expected_use(self):
+        ''' Returns the inodes in use (exact), and the most data blocks in use, for the files made. '''
+
+        # Root, the directories and the files, and for blocks the most entries each directory has had.
+        inodes = 1 + DIRECTORIES + len(self.files)
+        blocks = self.blocks_used() + sum(dirent_position(self.layout, entries - 1)[0] + 1
+                                          for entries in [2 + DIRECTORIES] + self.mostEntries)
+
+        return inodes, blocks
+
+def disk_use(path: str):
+    ''' Returns the inodes and data blocks in use, according to the bitmaps of the disk image. '''
+
+    with DiskImage(path) as image:
+        layout = image.layout
+        return (sum(1 for num in range(layout["inode_count"]) if image.inode_used(num)),
+                sum(1 for num in range(layout["data_count"]) if image.data_used(num)))
+
+def window_result(churn: Churn, seconds: float):
+    ''' Returns the statistics of the window just run, and starts a new window. '''
+
+    inodes, blocks = disk_use(cfg.PATH + "/" + cfg.DISK_NAME)
+    expectedInodes, mostBlocks = churn.expected_use()
+    stats = summarize(churn.latencies)
+
+    result = {
+        "operations": churn.count,
+        "count": len(churn.latencies),
+        "ops_per_sec": len(churn.latencies) / seconds if seconds > 0 else None,
+        "p50": stats["p50"],
+        "p99": stats["p99"],
+        "max": stats["max"],
+        "p50_per_command": {kind: summarize(values)["p50"] for kind, values in sorted(churn.kinds.items())},
+        "count_per_command": {kind: len(values) for kind, values in sorted(churn.kinds.items())},
+        "files": len(churn.files),
+        "inodes_used": inodes,
+        "inodes_expected": expectedInodes,
+        "blocks_used": blocks,
+        "blocks_most": mostBlocks,
+    }
+
+    churn.latencies = []
+    churn.kinds = {}
+
+    return result
+
+def slowdown(windows: list):
+    '''
+    Returns the largest median latency of a command type in the last
+    windows relative to the first ones (after the first), and the command
+    type, or (None, None) if there are too few windows.
+    '''
+
+    full = windows[1:]
+    if len(full) < 2 * BASE_WINDOWS:
+        return None, None
+
+    compared = full[:BASE_WINDOWS] + full[-BASE_WINDOWS:]
+    worst = (None, None)
+
+    for kind in sorted(full[0]["p50_per_command"]):
+        if any(window["count_per_command"].get(kind, 0) < MIN_COMMANDS for window in compared):
+            continue
+
+        first = statistics.median(window["p50_per_command"][kind] for window in full[:BASE_WINDOWS])
+        last = statistics.median(window["p50_per_command"][kind] for window in full[-BASE_WINDOWS:])
+
+        if first > 0 and (worst[0] is None or last / first > worst[0]):
+            worst = (last / first, kind)
+
+    return worst
+
+def soak(operations: int, seconds: float = None, window: int = 1000, seed: int = 0, stream=sys.stdout):
+    '''
+    Runs churn in one shell until the operations are done or the seconds
+    have passed, and returns the results as a dictionary. Every window of
+    operations is printed to stream as it ends.
+    '''
+
+    cfg.compile()
+    results = {"build_hash": cfg.BUILD_HASH, "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "seed": seed,
+               "window": window, "max_slowdown": MAX_SLOWDOWN, "windows": [], "problems": []}
+    windows = results["windows"]
+
+    start = time.perf_counter()
+    end = start + seconds if seconds is not None else None
+
+    try:
+        with ShellSession() as shell:
+            churn = Churn(shell, seed)
+            churn.setup()
+            windowStart = time.perf_counter()
+
+            while churn.count < operations and (end is None or time.perf_counter() < end):
+                churn.step()
+
+                if len(churn.latencies) >= window:
+                    now = time.perf_counter()
+                    windows.append(window_result(churn, now - windowStart))
+                    windowStart = now
+
+                    last = windows[-1]
+                    stream.write("{:>9} ops: {:7.0f} ops/s, p50 {:7.3f} ms, p99 {:7.3f} ms, {:>3} files, "
+                                 "{:>3} inodes, {:>3} blocks\n".format(last["operations"], last["ops_per_sec"],
+                                 last["p50"] * 1000, last["p99"] * 1000, last["files"], last["inodes_used"],
+                                 last["blocks_used"]))
+                    stream.flush()
+
+                    # Leaks are found at once, the numbers only grow.
+                    if last["inodes_used"] != last["inodes_expected"]:
+                        results["problems"].append("{} inodes in use after {} operations, the files need {}".format(
+                                                   last["inodes_used"], last["operations"], last["inodes_expected"]))
+                    if last["blocks_used"] > last["blocks_most"]:
+                        results["problems"].append("{} data blocks in use after {} operations, the files need at most {}"
+                                                   .format(last["blocks_used"], last["operations"], last["blocks_most"]))
+                    if results["problems"]:
+                        break
+
+    except SoakError as error:
+        results["problems"].append(str(error))
+
+    results["operations"] = sum(window["count"] for window in windows)
+    results["seconds"] = time.perf_counter() - start
+    results["slowdown"], results["slowdown_command"] = slowdown(windows)
+
+    if results["slowdown"] is not None and results["slowdown"] > MAX_SLOWDOWN:
+        results["problems"].append("median latency of {} grew {:.2f} times, from the first to the last {} windows".format(
+                                   results["slowdown_command"], results["slowdown"], BASE_WINDOWS))
+
+    # The disk image must still be consistent.
+    results["problems"] += check_disk(cfg.PATH + "/" + cfg.DISK_NAME)
+
+    cfg.cleanup()
+    DEADLINES.save()
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Soak test of the file system.")
+    parser.add_argument("--operations", type=int, default=20000, help="commands to run")
+    parser.add_argument("--seconds", type=float, help="stop after this time, even if not all commands are run")
+    parser.add_argument("--window", type=int, default=1000, help="commands per window")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="JSON file to write")
+    args = parser.parse_args()
+    if cfg.DISK_LAYOUT is None:
+        parser.error("DISK_LAYOUT in config.py is not set, the soak test counts inodes and blocks with it")
+
+    results = soak(args.operations, args.seconds, args.window, args.seed)
+
+    if args.output:
+        with open(args.output, "w") as outFile:
+            json.dump(results, outFile, indent=2)
+
+    print("{} commands in {:.1f} s, slowdown {}.".format(results["operations"], results["seconds"],
+          "{:.2f} ({})".format(results["slowdown"], results["slowdown_command"]) if results["slowdown"] is not None
+          else "not known (too few windows)"))
+    for problem in results["problems"]:
+        print("  " + problem)
+
+    sys.exit(1 if results["problems"] else 0)
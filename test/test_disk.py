@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: standalone test of the disk image reader and fsck, on images built without the shell.
+Date: 18.10.26
+'''
+
+import os
+import tempfile
+import unittest
+from image_builder import write_image, HardLink
+from disk_image import DiskImage, fsck
+
+# A layout given to the reader, so the test does not need DISK_LAYOUT in config.py.
+TEST_LAYOUT = {
+    "block_size": 512,
+    "superblock": 0,
+    "inode_bitmap": 1,
+    "data_bitmap": 2,
+    "inode_table": 3,
+    "inode_count": 64,
+    "inode_size": 32,
+    "data_start": 7,
+    "data_count": 128,
+    "root_inode": 0,
+    "magic": 0x1234,
+    "superblock_fields": [("magic", "I"), ("inode_count", "H"), ("data_count", "H"),
+                          ("inode_bitmap", "H"), ("data_bitmap", "H"), ("inode_table", "H"),
+                          ("data_start", "H"), ("root_inode", "H")],
+    "inode_fields": [("type", "h"), ("nlinks", "h"), ("size", "i"), ("direct", "8h"), ("indirect", "h")],
+    "dirent_fields": [("name", "18s"), ("inode", "h")],
+    "file_type": 1,
+    "dir_type": 2,
+    "null_block": -1,
+}
+
+# The same with 4-byte block pointers, and a superblock field which is not a layout key.
+WIDE_LAYOUT = dict(TEST_LAYOUT, inode_size=64, data_start=11, superblock_values={"free_blocks": 0},
+                   superblock_fields=TEST_LAYOUT["superblock_fields"] + [("free_blocks", "H")],
+                   inode_fields=[("type", "h"), ("nlinks", "h"), ("size", "i"), ("direct", "8i"), ("indirect", "i")])
+
+# Directories, a file using the indirect block, and a hard link.
+TEST_TREE = {
+    "docs": {"a.txt": "Hello World!\n", "deep": {"b.txt": "b\n"}},
+    "large": "".join("Line number {:019d}\n".format(num) for num in range(200)),
+    "alias": HardLink("/docs/a.txt"),
+}
+
+class TestDiskImage(unittest.TestCase):
+    '''
+    Builds disk images with a fixed layout, and checks that fsck finds a
+    built image consistent, and finds damage made to it.
+    '''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpDir.name, "disk")
+        write_image(TEST_TREE, self.path, TEST_LAYOUT)
+
+    def inode_of(self, image: DiskImage, path: str):
+        ''' Returns the inode number of an absolute path in the image. '''
+        return dict(image.walk())[path]
+
+    def test_fsck_built_image(self):
+        ''' Check that a built image is consistent, and its files are read back. '''
+
+        with DiskImage(self.path, TEST_LAYOUT) as image:
+            problems = fsck(image)
+            self.assertEqual(problems, [], "Built disk image is not consistent: {}".format(problems))
+
+            # The large file uses the indirect block, all of it must be found.
+            inode = image.inode(self.inode_of(image, "/large"))
+            blocks, indirect = image.blocks(inode)
+            self.assertIsNotNone(indirect, "The large file does not use the indirect block")
+            self.assertEqual(len(blocks), -(-len(TEST_TREE["large"]) // TEST_LAYOUT["block_size"]))
+
+    def test_fsck_wide_pointers(self):
+        ''' Check an image with 4-byte block pointers, in the inodes and the indirect block. '''
+
+        write_image(TEST_TREE, self.path, WIDE_LAYOUT)
+
+        with DiskImage(self.path, WIDE_LAYOUT) as image:
+            problems = fsck(image)
+            self.assertEqual(problems, [], "Built disk image is not consistent: {}".format(problems))
+
+            blocks, indirect = image.blocks(image.inode(self.inode_of(image, "/large")))
+            self.assertEqual(len(blocks), -(-len(TEST_TREE["large"]) // WIDE_LAYOUT["block_size"]))
+
+    def test_fsck_data_bitmap(self):
+        ''' Check that fsck finds a used block marked free in the data bitmap. '''
+
+        with DiskImage(self.path, TEST_LAYOUT, writable=True) as image:
+            block = image.blocks(image.inode(self.inode_of(image, "/docs")))[0][0]
+            image.view[TEST_LAYOUT["data_bitmap"] * TEST_LAYOUT["block_size"] + block // 8] &= ~(1 << (block % 8)) & 0xFF
+
+            problems = fsck(image)
+
+        self.assertIn("block {} is used by inode".format(block), " ".join(problems))
+
+    def test_fsck_link_count(self):
+        ''' Check that fsck finds a link count not matching the directory entries. '''
+
+        with DiskImage(self.path, TEST_LAYOUT, writable=True) as image:
+            num = self.inode_of(image, "/docs/deep/b.txt")
+            inode = image.inode(num)
+            inode["nlinks"] += 1
+            image.inodeFormat.pack_into(image.view, image.inode_offset(num), inode)
+
+            problems = fsck(image)
+
+        self.assertIn("inode {} has 2 links, but 1 directory entries".format(num), problems)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,22 @@ Date: 24.05.22
 import unittest
 import config as cfg
 from sim_comms import run_commands, validate_output, construct_multi_command
+from snapshots import use_state
+
+# A 5-level directory containing three directories, made once for the cd tests.
+FIVE_LEVELS = [construct_multi_command(["mkdir one",
+                                        "cd one",
+                                        "mkdir two",
+                                        "cd two",
+                                        "mkdir three",
+                                        "cd three",
+                                        "mkdir four",
+                                        "cd four",
+                                        "mkdir five",
+                                        "cd five",
+                                        "mkdir findMe1",
+                                        "mkdir findMe2",
+                                        "mkdir findMe3"])]
 
 class TestShellFunctions(unittest.TestCase):
     ''' Short tests of all the different file system shell commands. '''
@@ -49,24 +65,8 @@ class TestShellFunctions(unittest.TestCase):
     def test_cd_relative(self):
         ''' Testing with main focus on the cd command, with relative paths. '''
 
-        # Create a 5-level directory containing three directories.
-        multiLineInput = construct_multi_command(["mkdir one",
-                                                    "cd one",
-                                                    "mkdir two",
-                                                    "cd two",
-                                                    "mkdir three",
-                                                    "cd three",
-                                                    "mkdir four",
-                                                    "cd four",
-                                                    "mkdir five",
-                                                    "cd five",
-                                                    "mkdir findMe1",
-                                                    "mkdir findMe2",
-                                                    "mkdir findMe3"])
-
-        # Create directory three with no errors.
-        shellOutput = run_commands([multiLineInput])
-        errorCode = validate_output(shellOutput, [])
+        # Create directory three with no errors, or restore it from the run of another cd test.
+        errorCode = use_state("five_levels", FIVE_LEVELS)
         msg = "Error with mkdir or cd: {}".format(errorCode)
         self.assertEqual(errorCode, 0, msg)
 
@@ -87,24 +87,8 @@ class TestShellFunctions(unittest.TestCase):
     def test_cd_absolute(self):
         ''' Testing with main focus on the cd command, with absolute paths. '''
 
-        # Create a 5-level directory containing three directories.
-        multiLineInput = construct_multi_command(["mkdir one",
-                                                    "cd one",
-                                                    "mkdir two",
-                                                    "cd two",
-                                                    "mkdir three",
-                                                    "cd three",
-                                                    "mkdir four",
-                                                    "cd four",
-                                                    "mkdir five",
-                                                    "cd five",
-                                                    "mkdir findMe1",
-                                                    "mkdir findMe2",
-                                                    "mkdir findMe3"])
-
-        # Create directory three with no errors.
-        shellOutput = run_commands([multiLineInput])
-        errorCode = validate_output(shellOutput, [])
+        # Create directory three with no errors, or restore it from the run of another cd test.
+        errorCode = use_state("five_levels", FIVE_LEVELS)
         msg = "Error with mkdir or cd: {}".format(errorCode)
         self.assertEqual(errorCode, 0, msg)
 
@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: standalone random test of the file system, see fuzz.py.
+Date: 18.10.26
+'''
+
+import unittest
+import config as cfg
+from fuzz import fuzz, Divergence
+
+class TestFuzz(unittest.TestCase):
+    '''
+    Runs random commands in long shell sessions, and checks every result
+    with a model of the file system. Run fuzz.py for longer sequences.
+    '''
+
+    def setUp(self):
+        cfg.compile()
+
+    def test_random_commands(self):
+        ''' Test 1000 random commands, the same every run. '''
+
+        try:
+            fuzz(seed=2201, operations=1000, sessionLength=250)
+        except Divergence as error:
+            self.fail("File system differs from the model: {}".format(error))
+
+    def tearDown(self):
+        cfg.cleanup()
+
+if __name__ == '__main__':
+    unittest.main()
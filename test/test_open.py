@@ -8,7 +8,7 @@ Date: 24.05.22
 
 import unittest
 import config as cfg
-from sim_comms import run_commands, validate_output
+from sim_comms import run_commands, validate_output, run_batch
 
 class TestOpen(unittest.TestCase):
     ''' Test fs_open functionality with different shell commands. '''
@@ -72,13 +72,13 @@ class TestOpen(unittest.TestCase):
             catCommands.append("cat myFile_" + str(num))
             expectedFiles.append("myFile_" + str(num))
 
-        # Create the files with cat.
-        shellOutput = run_commands(catCommands)
+        # Create the files with cat, all in one shell.
+        for catCommand, shellOutput in zip(catCommands, run_batch(catCommands)):
 
-        # Creating the files should not cause any errors.
-        errorCode = validate_output(shellOutput, [])
-        msg = "Error creating files: {}".format(errorCode)
-        self.assertEqual(errorCode, 0, msg)
+            # Creating the files should not cause any errors.
+            errorCode = validate_output(shellOutput, [])
+            msg = "Error creating files with {}: {}".format(catCommand, errorCode)
+            self.assertEqual(errorCode, 0, msg)
 
         # List directory with newly created files.
         shellOutput = run_commands(["ls"])
@@ -88,11 +88,13 @@ class TestOpen(unittest.TestCase):
         msg = "Error listing files: {}".format(errorCode)
         self.assertEqual(errorCode, 0, msg)
 
-        # Try to open some of the files. All of them should be found.
-        shellOutput = run_commands(["more myFile_3", "more myFile_24", "more myFile_50"])
-        errorCode = validate_output(shellOutput, ["myFile_3", "myFile_24", "myFile_50"])
-        msg = "Invalid or broken files: {}".format(errorCode)
-        self.assertEqual(errorCode, 0, msg)
+        # Try to open some of the files. All of them should be found, each by its own command.
+        checkFiles = ["myFile_3", "myFile_24", "myFile_50"]
+        outputs = run_batch(["more " + name for name in checkFiles])
+        for name, shellOutput in zip(checkFiles, outputs):
+            errorCode = validate_output(shellOutput, [name])
+            msg = "Invalid or broken file {}: {}".format(name, errorCode)
+            self.assertEqual(errorCode, 0, msg)
 
     def test_open_invalid_name(self):
         '''
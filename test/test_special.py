@@ -8,7 +8,10 @@ Date: 24.05.22
 
 import unittest
 import config as cfg
-from sim_comms import run_commands, validate_output, construct_multi_command, cat_write
+from sim_comms import run_commands, validate_output, construct_multi_command, cat_write, check_commands, verify_file
+from snapshots import use_state
+from image_builder import write_image, HardLink
+from disk_image import check_disk, RecordFormat
 
 class TestSpecialCases(unittest.TestCase):
     '''
@@ -43,16 +46,10 @@ class TestSpecialCases(unittest.TestCase):
         msg = "Cat invalid file size with more: {}".format(error)
         self.assertEqual(error, 0, msg)
 
-        # Get list of words from stringList.
-        searchWords = []
-        for string in stringList:
-            for word in string.split():
-                searchWords.append(word)
-
-        # Validate the more command output, expect to find the text. 
-        error = validate_output(output, searchWords)
-        msg = "Invalid multi-block file read: {}".format(error)
-        self.assertEqual(error, 0, msg)
+        # Validate the more command output, byte for byte against the text written.
+        result = verify_file("myTextFile", stringList)
+        msg = "Invalid multi-block file read, first wrong byte: {}".format(result)
+        self.assertIsNone(result["offset"], msg)
 
         # Truncate the large file with a new input.
         error = cat_write("myTextFile", ["The file has been truncated!"])
@@ -66,11 +63,43 @@ class TestSpecialCases(unittest.TestCase):
         self.assertEqual(error, 0, msg)
 
         # Read and verify the output of the truncated file.
-        output = run_commands(["more myTextFile"])
-        error = validate_output(output, ["The", "file", "has", "been", "truncated!"])
-        msg = "Invalid multi-block truncated file read: {}".format(error)
+        result = verify_file("myTextFile", ["The file has been truncated!"])
+        msg = "Invalid multi-block truncated file read, first wrong byte: {}".format(result)
+        self.assertIsNone(result["offset"], msg)
+
+    @unittest.skipIf(cfg.DISK_LAYOUT is None, "DISK_LAYOUT in config.py is not set")
+    def test_cat_indirect(self):
+        ''' Test read and write of the largest file, using all direct blocks and the indirect block. '''
+
+        layout = cfg.DISK_LAYOUT
+        blockSize = layout["block_size"]
+        inodeFormat = RecordFormat(layout["inode_fields"])
+        pointers = inodeFormat.count("direct") + blockSize // inodeFormat.value_size("direct")
+
+        # All blocks the direct and indirect pointers reach, or all free blocks but the root directory and indirect block.
+        blockCount = min(pointers, layout["data_count"] - 2)
+
+        # Lines of 32 bytes, filling every block.
+        lineCount = blockCount * blockSize // 32
+        stringList = ["myLine_{:024d}".format(num) for num in range(lineCount)]
+
+        # Write the file in chunks, as fast as the shell reads it.
+        error = cat_write("myLargeFile", iter(stringList))
+        msg = "Cat indirect block write error: {}".format(error)
         self.assertEqual(error, 0, msg)
 
+        # Check file size.
+        output = run_commands(["stat myLargeFile"])
+        error = validate_output(output, ["myLargeFile:", str(lineCount * 32)])
+        msg = "Invalid indirect block file size: {}".format(error)
+        self.assertEqual(error, 0, msg)
+
+        # Check that every line is read back, in order, up to the last byte of the last block.
+        result = verify_file("myLargeFile", iter(stringList))
+        msg = "Invalid indirect block file read, first wrong byte: {}".format(result)
+        self.assertIsNone(result["offset"], msg)
+        self.assertEqual(result["size"], blockCount * blockSize, msg)
+
     def test_multi_level_dirs(self):
         ''' Verify that the file system works with multi-level directories. '''
         
@@ -86,9 +115,8 @@ class TestSpecialCases(unittest.TestCase):
         # Create two additional directories in the last directory.
         multiCmd += "mkdir myFolder1" + "\n" + "mkdir myFolder2" + "\n"
 
-        # Build the large directory three.
-        output = run_commands([multiCmd])
-        error = validate_output(output, [])
+        # Build the large directory three, or restore it from a snapshot.
+        error = use_state("multi_level_dirs", [multiCmd])
         msg = "Failed to create multi-level directories: {}".format(error)
         self.assertEqual(error, 0, msg)
 
@@ -128,9 +156,8 @@ class TestSpecialCases(unittest.TestCase):
             multiCmd += "mkdir d{}".format(dir) + "\n"
             dirNames.append("d{}".format(dir))
 
-        # Create all the directories.
-        output = run_commands([multiCmd])
-        error = validate_output(output, [])
+        # Create all the directories, or restore them from a snapshot.
+        error = use_state("200_dirs", [multiCmd])
         msg = "Failed to create 200 directories: {}".format(error)
         self.assertEqual(error, 0, msg)
 
@@ -211,15 +238,13 @@ class TestSpecialCases(unittest.TestCase):
         # Attempt to exhaust bitmap/data blocks.
         for steps in range(0, 50):
             
-            # Create directories
-            output = run_commands([multiCmdMkdirs])
-            error = validate_output(output, [])
+            # Create directories, stop at the first error.
+            error = check_commands([multiCmdMkdirs], [])
             msg = "Could not create directories: {}".format(error)
             self.assertEqual(error, 0, msg)
 
             # Remove directories, test free.
-            output = run_commands([multiCmdRmdirs])
-            error = validate_output(output, [])
+            error = check_commands([multiCmdRmdirs], [])
             msg = "Could not remove directories: {}".format(error)
             self.assertEqual(error, 0, msg)
 
@@ -229,6 +254,50 @@ class TestSpecialCases(unittest.TestCase):
         msg = "Root directory is damaged: {}".format(error)
         self.assertEqual(error, 0, msg)
 
+    @unittest.skipIf(cfg.DISK_LAYOUT is None, "DISK_LAYOUT in config.py is not set")
+    def test_built_image(self):
+        ''' Test that the shell reads a large tree built straight into the disk image. '''
+
+        depth = 40
+        dirNames = ["d{}".format(num) for num in range(3, 171)]
+        bigLines = ["Built line number {:05d}, a file of several blocks.".format(num) for num in range(60)]
+
+        # Root with more entries than one directory block holds, a deep path, and files in both.
+        deep = {"myFile": "Hello from the bottom\n"}
+        for level in reversed(range(depth)):
+            deep = {"l{}".format(level): deep}
+        tree = {name: {} for name in dirNames}
+        tree.update({"deep": deep, "bigFile": "".join(line + "\n" for line in bigLines),
+                     "alias": HardLink("/deep/" + "/".join("l{}".format(level) for level in range(depth)) + "/myFile")})
+        write_image(tree)
+
+        # List every root entry, also those in the last directory block.
+        output = run_commands(["ls"])
+        error = validate_output(output, [".", ".."] + dirNames + ["deep", "bigFile", "alias"])
+        msg = "Failed to list the built root directory: {}".format(error)
+        self.assertEqual(error, 0, msg)
+
+        # Read the file at the bottom of the deep path, and through its hard link.
+        cdStr = "cd /deep/" + "/".join("l{}".format(level) for level in range(depth))
+        output = run_commands([construct_multi_command([cdStr, "more myFile", "cd /", "more alias"])])
+        error = validate_output(output, ["Hello", "from", "the", "bottom"] * 2)
+        msg = "Failed to read a file in the built deep path: {}".format(error)
+        self.assertEqual(error, 0, msg)
+
+        # Read the multi-block file byte for byte.
+        result = verify_file("bigFile", bigLines)
+        msg = "Invalid read of a built multi-block file, first wrong byte: {}".format(result)
+        self.assertIsNone(result["offset"], msg)
+
+        # Add an entry after the built ones, and check the image is still consistent.
+        output = run_commands(["mkdir newDir", "ls"])
+        error = validate_output(output, ["newDir", "d170", "alias"])
+        msg = "Failed to add an entry to the built root directory: {}".format(error)
+        self.assertEqual(error, 0, msg)
+
+        problems = check_disk(cfg.PATH + "/" + cfg.DISK_NAME)
+        self.assertEqual(problems, [], "Built disk image is not consistent after use: {}".format(problems))
+
     def test_cd_too_root(self):
         ''' Check that changing directory to root works. '''
 
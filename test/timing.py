@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+'''
+Written by: Isak Kjerstad.
+Purpose: statistics for measured command latencies.
+Date: 18.10.26
+'''
+
+import math
+import statistics
+
+def percentile(sortedValues: list, percent: float):
+    ''' Returns the nearest-rank percentile of a sorted, non-empty list. '''
+
+    rank = max(1, math.ceil(percent / 100 * len(sortedValues)))
+    return sortedValues[rank - 1]
+
+def summarize(latencies: list, warmup: int = 0):
+    '''
+    Returns a dictionary of statistics for latencies in seconds. The first
+    warmup values are left out, as they include cold caches, but at least
+    one value is always kept. Returns None for an empty list.
+    '''
+
+    if not latencies:
+        return None
+
+    warmup = max(0, min(warmup, len(latencies) - 1))
+    values = sorted(latencies[warmup:])
+
+    total = sum(values)
+
+    return {
+        "count": len(values),
+        "warmup": warmup,
+        "ops_per_sec": len(values) / total if total > 0 else None,
+        "mean": statistics.mean(values),
+        "stdev": statistics.stdev(values) if len(values) > 1 else 0.0,
+        "min": values[0],
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+    }
+
+# Complexity models, as functions of the size n.
+MODELS = {
+    "1": lambda n: 0.0,
+    "n": lambda n: float(n),
+    "n log n": lambda n: n * math.log2(max(n, 2)),
+    "n^2": lambda n: float(n) ** 2,
+}
+
+def fit_model(sizes: list, times: list, model):
+    '''
+    Fits times = a + b * f(sizes) by least squares, with b >= 0, for a model
+    in MODELS, or a function f. Returns (a, b, sum of squared residuals).
+    '''
+
+    function = MODELS[model] if isinstance(model, str) else model
+    values = [function(size) for size in sizes]
+    meanValue = statistics.mean(values)
+    meanTime = statistics.mean(times)
+    spread = sum((value - meanValue) ** 2 for value in values)
+
+    slope = 0.0
+    if spread > 0:
+        slope = max(0.0, sum((value - meanValue) * (time - meanTime) for value, time in zip(values, times)) / spread)
+    intercept = meanTime - slope * meanValue
+
+    residual = sum((intercept + slope * value - time) ** 2 for value, time in zip(values, times))
+    return intercept, slope, residual
+
+def best_model(sizes: list, times: list):
+    ''' Returns the name of the complexity model in MODELS fitting times best, and the fits of all models. '''
+
+    fits = {model: fit_model(sizes, times, model) for model in MODELS}
+    return min(MODELS, key=lambda model: fits[model][2]), fits
+
+def growth_exponent(sizes: list, times: list):
+    '''
+    Fits times = a + b * n^k, and returns the exponent k (0 to 3, in steps of
+    0.05). The constant a holds fixed costs, like sending the command, so k
+    only describes the growth.
+    '''
+
+    exponents = [step * 0.05 for step in range(61)]
+    residuals = [fit_model(sizes, times, lambda n, k=exponent: float(n) ** k)[2] for exponent in exponents]
+
+    return exponents[residuals.index(min(residuals))]